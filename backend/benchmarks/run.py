@@ -0,0 +1,266 @@
+"""Replay a lecture workload against the API with local stand-ins and report per-endpoint latency.
+
+Usage (from backend/):
+    python -m benchmarks.run --listeners 200 --duration 60 --output bench.json
+    python -m benchmarks.run --baseline bench.json   # exit 1 on p95 regressions
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+from collections import defaultdict
+from typing import List, Dict, Any, Optional
+
+# Keep the app away from every real backend before it is imported
+for key in ("OPENAI_API_KEY", "GEMINI_API_KEY", "PINECONE_API_KEY", "PINECONE_ENVIRONMENT",
+            "FIREBASE_PROJECT_ID", "FIREBASE_PRIVATE_KEY", "FIREBASE_CLIENT_EMAIL"):
+    os.environ[key] = ""
+
+import httpx
+
+from benchmarks.stubs import (
+    FakeFirebaseAuth, InMemoryMongoClient, StubVectorStoreService, make_token
+)
+from services.ai_service import AIService
+from services.auth_service import AuthService
+from services.database import DatabaseService
+from services.llm_router import LLMRouter, StubProvider
+from services.shared_cache import SharedCache
+
+LECTURE_SENTENCES = [
+    "Today we are looking at how neural networks learn from data.",
+    "Each layer applies a linear transformation followed by a non-linear activation.",
+    "Gradient descent adjusts the weights to reduce the loss on the training set.",
+    "Overfitting happens when the model memorizes noise instead of the signal.",
+    "Regularization techniques like dropout help the network generalize.",
+    "Validation data tells us when to stop training.",
+    "Convolutional layers share weights across spatial positions in an image.",
+    "Attention lets a model weigh different parts of its input dynamically.",
+]
+
+LISTENER_QUESTIONS = [
+    "What is gradient descent?",
+    "Can you explain overfitting again?",
+    "Why do we need a validation set?",
+    "What does dropout do?",
+    "How does attention work?",
+]
+
+class Recorder:
+    """Collect request latencies and status codes per endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status_code = response.status_code
+        except Exception:
+            response = None
+            status_code = 0
+        self.latencies[name].append(time.perf_counter() - started)
+        self.statuses[name][status_code] += 1
+        return response
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for name, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            statuses = self.statuses[name]
+            endpoints[name] = {
+                "count": len(ordered),
+                "throughput_rps": round(len(ordered) / elapsed, 2),
+                "errors": sum(count for code, count in statuses.items() if not 200 <= code < 300),
+                "statuses": {str(code): count for code, count in sorted(statuses.items())},
+                "mean_ms": round(1000 * sum(ordered) / len(ordered), 2),
+                "p50_ms": round(1000 * percentile(ordered, 50), 2),
+                "p95_ms": round(1000 * percentile(ordered, 95), 2),
+                "p99_ms": round(1000 * percentile(ordered, 99), 2),
+                "max_ms": round(1000 * ordered[-1], 2),
+            }
+        return endpoints
+
+def percentile(ordered: List[float], p: float) -> float:
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def install_stand_ins(app_module, args):
+    """Run the app's real services on local stand-ins for their drivers and upstream APIs"""
+    provider = StubProvider(
+        name="stub-llm",
+        latency=args.llm_latency,
+        jitter=args.llm_latency / 2,
+        responder=lambda prompt: (
+            '[{"title": "Review the lecture", "description": "Go over today\'s notes", "priority": "medium"}]'
+            if "JSON array" in prompt else "Stub answer based on the session content."
+        )
+    )
+    app_module.shared_cache = SharedCache(socket_path=args.cache_socket)
+    app_module.auth_service = AuthService(app_module.shared_cache)
+    app_module.auth_service._auth = FakeFirebaseAuth(latency=args.auth_latency)
+    app_module.db_service = DatabaseService(app_module.shared_cache)
+    app_module.db_service.client.close()
+    app_module.db_service.client = InMemoryMongoClient(latency=args.db_latency)
+    app_module.db_service.db = app_module.db_service.client[app_module.db_service.db_name]
+    app_module.vector_service = StubVectorStoreService(
+        embedding_latency=args.embedding_latency, index_latency=args.index_latency,
+        cache=app_module.shared_cache
+    )
+    app_module.ai_service = AIService(router=LLMRouter([provider]))
+    return provider
+
+async def seed(client: httpx.AsyncClient, listeners: int) -> Dict[str, Any]:
+    """Create the speaker, listeners and a live session through the API"""
+    speaker_uid = "bench-speaker"
+    users = [("bench-speaker", "speaker")] + [(f"bench-listener-{i}", "listener") for i in range(listeners)]
+    for uid, role in users:
+        await client.post("/auth/create-profile", json={
+            "uid": uid, "email": f"{uid}@bench.local", "displayName": uid, "role": role
+        })
+
+    speaker_headers = {"Authorization": f"Bearer {make_token(speaker_uid)}"}
+    session = (await client.post("/sessions/create", headers=speaker_headers)).json()
+    for uid, role in users[1:]:
+        await client.post("/sessions/join", json={"joinCode": session["joinCode"]},
+                          headers={"Authorization": f"Bearer {make_token(uid)}"})
+    return {"session": session, "speaker_headers": speaker_headers, "listeners": [uid for uid, _ in users[1:]]}
+
+async def speaker_loop(client, recorder: Recorder, state, stop_at: float, args):
+    session_id = state["session"]["id"]
+    headers = state["speaker_headers"]
+    spoken = []
+    last_tasks = time.monotonic()
+    while time.monotonic() < stop_at:
+        sentence = random.choice(LECTURE_SENTENCES)
+        spoken.append(sentence)
+        await recorder.request(client, "POST /sessions/{id}/transcript", "POST",
+                               f"/sessions/{session_id}/transcript", json={"text": sentence}, headers=headers)
+        if time.monotonic() - last_tasks >= args.tasks_interval:
+            last_tasks = time.monotonic()
+            await recorder.request(client, "POST /sessions/{id}/tasks", "POST",
+                                   f"/sessions/{session_id}/tasks", json={"transcript": " ".join(spoken)}, headers=headers)
+        await asyncio.sleep(args.transcript_interval)
+
+async def listener_loop(client, recorder: Recorder, state, uid: str, stop_at: float, args):
+    session_id = state["session"]["id"]
+    headers = {"Authorization": f"Bearer {make_token(uid)}"}
+    # Spread listeners out so they don't all poll in lockstep
+    await asyncio.sleep(random.uniform(0, args.poll_interval))
+    while time.monotonic() < stop_at:
+        await recorder.request(client, "GET /sessions/{id}/transcript", "GET", f"/sessions/{session_id}/transcript", headers=headers)
+        await recorder.request(client, "GET /sessions/{id}/tasks", "GET", f"/sessions/{session_id}/tasks", headers=headers)
+        await recorder.request(client, "GET /sessions/{id}/resources/active", "GET", f"/sessions/{session_id}/resources/active", headers=headers)
+        if random.random() < args.query_probability:
+            await recorder.request(client, "POST /sessions/{id}/query", "POST", f"/sessions/{session_id}/query",
+                                   json={"message": random.choice(LISTENER_QUESTIONS)}, headers=headers)
+        if random.random() < 0.05:
+            await recorder.request(client, "GET /auth/profile", "GET", "/auth/profile", headers=headers)
+            await recorder.request(client, "GET /sessions/list", "GET", "/sessions/list", headers=headers)
+            await recorder.request(client, "GET /sessions/info/{code}", "GET", f"/sessions/info/{state['session']['joinCode']}")
+        await asyncio.sleep(args.poll_interval * random.uniform(0.8, 1.2))
+
+async def run(args) -> Dict[str, Any]:
+    import main as app_module
+
+    provider = install_stand_ins(app_module, args)
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app_module.app)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with app_module.app.router.lifespan_context(app_module.app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=60) as client:
+        state = await seed(client, args.listeners)
+
+        started = time.monotonic()
+        stop_at = started + args.duration
+        await asyncio.gather(
+            speaker_loop(client, recorder, state, stop_at, args),
+            *[listener_loop(client, recorder, state, uid, stop_at, args) for uid in state["listeners"]]
+        )
+        elapsed = time.monotonic() - started
+
+    endpoints = recorder.report(elapsed)
+    return {
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "elapsed_s": round(elapsed, 2),
+        "total_requests": sum(endpoint["count"] for endpoint in endpoints.values()),
+        "upstream_calls": {
+            "llm": provider.calls,
+            "token_verifications": app_module.auth_service._auth.calls,
+            "embedding": app_module.vector_service.embedding_calls,
+            "vectors_indexed": len(app_module.vector_service.index.vectors)
+        },
+        "endpoints": endpoints
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """List endpoints whose p95 latency regressed beyond the tolerance"""
+    regressions = []
+    for name, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        # Ignore sub-millisecond noise on trivially fast endpoints
+        limit = max(previous["p95_ms"] * (1 + tolerance), previous["p95_ms"] + 1.0)
+        if current["p95_ms"] > limit:
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+    return regressions
+
+def print_table(results: Dict[str, Any]):
+    header = f"{'endpoint':40} {'count':>7} {'rps':>8} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, row in results["endpoints"].items():
+        print(f"{name:40} {row['count']:>7} {row['throughput_rps']:>8} {row['errors']:>5} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+    print(f"\nupstream calls: {results['upstream_calls']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline PANDA API load test")
+    parser.add_argument("--listeners", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of steady-state load")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between listener polls")
+    parser.add_argument("--query-probability", type=float, default=0.1, help="chance a poll also asks a question")
+    parser.add_argument("--transcript-interval", type=float, default=1.0, help="seconds between speaker fragments")
+    parser.add_argument("--tasks-interval", type=float, default=20.0, help="seconds between task generations")
+    parser.add_argument("--auth-latency", type=float, default=0.001)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--index-latency", type=float, default=0.01)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--cache-socket", help="use a running shared cache server instead of a local cache")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--baseline", help="compare against an earlier --output file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p95 regression")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
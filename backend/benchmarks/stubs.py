@@ -0,0 +1,386 @@
+"""Local stand-ins for MongoDB, Pinecone, Firebase and the LLM/embedding providers."""
+import math
+import copy
+import time
+import asyncio
+import hashlib
+from typing import List, Dict, Any, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from services.vector_store import VectorStoreService
+
+TOKEN_PREFIX = "bench-token:"
+
+def make_token(uid: str) -> str:
+    """Bearer token accepted by FakeFirebaseAuth"""
+    return f"{TOKEN_PREFIX}{uid}"
+
+class FakeFirebaseAuth:
+    """Stand-in for firebase_admin.auth that accepts tokens made by make_token.
+
+    Installed as AuthService._auth, so the real AuthService (and its token cache) runs;
+    verify_id_token blocks like the real call, which AuthService runs in a thread.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def verify_id_token(self, token: str) -> Dict[str, Any]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if not token.startswith(TOKEN_PREFIX):
+            raise ValueError("Invalid benchmark token")
+        return {"uid": token[len(TOKEN_PREFIX):], "exp": time.time() + 3600}
+
+def _resolve(document: Any, path: List[str]) -> List[Any]:
+    """Every value a dotted path reaches, descending into arrays like MongoDB does"""
+    if not path:
+        return [document]
+    if isinstance(document, list):
+        if path[0].isdigit():
+            index = int(path[0])
+            return _resolve(document[index], path[1:]) if index < len(document) else []
+        return [value for item in document for value in _resolve(item, path)]
+    if isinstance(document, dict) and path[0] in document:
+        return _resolve(document[path[0]], path[1:])
+    return []
+
+def _matches_condition(values: List[Any], condition: Any) -> bool:
+    if condition is None:
+        # Like MongoDB, null matches missing fields too
+        return not values or None in values
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for operator, operand in condition.items():
+            if operator == "$exists":
+                if bool(values) != bool(operand):
+                    return False
+                continue
+            flat = [item for value in values for item in (value if isinstance(value, list) else [value])]
+            if operator == "$in":
+                ok = any(item in operand for item in flat)
+            elif operator == "$ne":
+                ok = all(item != operand for item in flat)
+            else:
+                compare = {"$lt": lambda a: a < operand, "$lte": lambda a: a <= operand,
+                           "$gt": lambda a: a > operand, "$gte": lambda a: a >= operand}[operator]
+                ok = any(item is not None and type(item) == type(operand) and compare(item) for item in flat)
+            if not ok:
+                return False
+        return True
+    return any(value == condition or (isinstance(value, list) and condition in value) for value in values)
+
+def matches(document: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Evaluate the subset of MongoDB query syntax DatabaseService uses"""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif not _matches_condition(_resolve(document, key.split(".")), condition):
+            return False
+    return True
+
+def _project(document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    slices = {key: value["$slice"] for key, value in projection.items() if isinstance(value, dict)}
+    included = [key for key, value in projection.items() if key not in slices and value and key != "_id"]
+    if included:
+        projected = {key: document[key] for key in included if key in document}
+        if projection.get("_id", 1) and "_id" in document:
+            projected["_id"] = document["_id"]
+        projected.update({key: document[key] for key in slices if key in document})
+        document = projected
+    else:
+        for key, value in projection.items():
+            if key not in slices and not value:
+                document.pop(key, None)
+    for key, spec in slices.items():
+        if isinstance(document.get(key), list):
+            items = document[key]
+            if isinstance(spec, list):
+                skip, limit = spec
+                start = skip if skip >= 0 else max(0, len(items) + skip)
+                document[key] = items[start:start + limit]
+            else:
+                document[key] = items[:spec] if spec >= 0 else items[spec:]
+    return document
+
+def _positional_index(document: Dict[str, Any], array_field: str, query: Dict[str, Any]) -> int:
+    """Index of the first array element matched by the query, for the positional $ operator"""
+    prefix = array_field + "."
+    conditions = {key[len(prefix):]: value for key, value in query.items() if key.startswith(prefix)}
+    for index, item in enumerate(document.get(array_field, [])):
+        if matches(item, conditions):
+            return index
+    raise ValueError(f"No array element of {array_field} matched the query")
+
+def _set_path(document: Dict[str, Any], path: str, value: Any, query: Dict[str, Any]):
+    parts = path.split(".")
+    if "$[]" in parts:
+        position = parts.index("$[]")
+        for item in _resolve(document, parts[:position])[0]:
+            _set_path(item, ".".join(parts[position + 1:]), copy.deepcopy(value), {})
+        return
+    if "$" in parts:
+        position = parts.index("$")
+        parts[position] = str(_positional_index(document, ".".join(parts[:position]), query))
+    target = document
+    for part in parts[:-1]:
+        target = target[int(part)] if isinstance(target, list) else target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+def apply_update(document: Dict[str, Any], update: Dict[str, Any], query: Dict[str, Any]):
+    """Apply the subset of MongoDB update operators DatabaseService uses, in place"""
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            value = copy.deepcopy(value)
+            if operator == "$set":
+                _set_path(document, path, value, query)
+            elif operator == "$unset":
+                document.pop(path, None)
+            elif operator == "$inc":
+                document[path] = document.get(path, 0) + value
+            elif operator == "$push":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                document.setdefault(path, []).extend(items)
+            elif operator == "$addToSet":
+                if value not in document.setdefault(path, []):
+                    document[path].append(value)
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported")
+
+class InMemoryResult:
+    def __init__(self, matched_count: int = 0, modified_count: int = 0, deleted_count: int = 0,
+                 inserted_id: Any = None, upserted_id: Any = None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.deleted_count = deleted_count
+        self.inserted_id = inserted_id
+        self.upserted_id = upserted_id
+
+class InMemoryCursor:
+    """Async cursor over a snapshot of matching documents"""
+
+    def __init__(self, documents: List[Dict[str, Any]], latency: float):
+        self.documents = documents
+        self.latency = latency
+
+    def sort(self, key: str, direction: int = 1) -> "InMemoryCursor":
+        self.documents.sort(key=lambda document: document.get(key) or "", reverse=direction < 0)
+        return self
+
+    def limit(self, count: int) -> "InMemoryCursor":
+        if count:
+            self.documents = self.documents[:count]
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self.latency)
+        for document in self.documents:
+            yield document
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        await asyncio.sleep(self.latency)
+        return self.documents[:length] if length else list(self.documents)
+
+class InMemoryCollection:
+    """Motor-compatible collection over a list of dicts, with a per-operation latency"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.documents: List[Dict[str, Any]] = []
+
+    async def _round_trip(self):
+        await asyncio.sleep(self.latency)
+
+    def _first(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return next((document for document in self.documents if matches(document, query)), None)
+
+    async def create_index(self, keys: Any, **kwargs) -> str:
+        await self._round_trip()
+        return str(keys)
+
+    async def insert_one(self, document: Dict[str, Any]) -> InMemoryResult:
+        await self._round_trip()
+        # Like pymongo, the caller's document gains its _id
+        document.setdefault("_id", ObjectId())
+        self.documents.append(copy.deepcopy(document))
+        return InMemoryResult(inserted_id=document["_id"])
+
+    async def find_one(self, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None):
+        await self._round_trip()
+        document = self._first(query)
+        return _project(document, projection) if document is not None else None
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> InMemoryCursor:
+        documents = [_project(document, projection) for document in self.documents if matches(document, query or {})]
+        return InMemoryCursor(documents, self.latency)
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> InMemoryResult:
+        await self._round_trip()
+        document = self._first(query)
+        if document is None:
+            if not upsert:
+                return InMemoryResult()
+            document = {key: value for key, value in query.items() if not key.startswith("$")}
+            document["_id"] = ObjectId()
+            apply_update(document, update, query)
+            self.documents.append(document)
+            return InMemoryResult(upserted_id=document["_id"])
+        apply_update(document, update, query)
+        return InMemoryResult(matched_count=1, modified_count=1)
+
+    async def find_one_and_update(self, query: Dict[str, Any], update: Dict[str, Any],
+                                  projection: Optional[Dict[str, Any]] = None,
+                                  return_document: bool = ReturnDocument.BEFORE):
+        await self._round_trip()
+        document = self._first(query)
+        if document is None:
+            return None
+        before = _project(document, projection)
+        apply_update(document, update, query)
+        return _project(document, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def replace_one(self, query: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False) -> InMemoryResult:
+        await self._round_trip()
+        document = self._first(query)
+        replacement = copy.deepcopy(replacement)
+        if document is None:
+            if not upsert:
+                return InMemoryResult()
+            replacement.setdefault("_id", ObjectId())
+            self.documents.append(replacement)
+            return InMemoryResult(upserted_id=replacement["_id"])
+        replacement["_id"] = document["_id"]
+        self.documents[self.documents.index(document)] = replacement
+        return InMemoryResult(matched_count=1, modified_count=1)
+
+    async def delete_one(self, query: Dict[str, Any]) -> InMemoryResult:
+        await self._round_trip()
+        document = self._first(query)
+        if document is None:
+            return InMemoryResult()
+        self.documents.remove(document)
+        return InMemoryResult(deleted_count=1)
+
+class InMemoryDatabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections: Dict[str, InMemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = InMemoryCollection(self.latency)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> InMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, name: str) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency)
+        return {"ok": 1.0}
+
+class InMemoryMongoClient:
+    """Stand-in for AsyncIOMotorClient; the real DatabaseService runs on top of it"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._databases: Dict[str, InMemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> InMemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = InMemoryDatabase(self.latency)
+        return self._databases[name]
+
+    def close(self):
+        pass
+
+class StubIndex:
+    """In-memory stand-in for a Pinecone index (cosine metric, metadata filter on equality)"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.vectors: Dict[str, Dict[str, Any]] = {}
+
+    def _round_trip(self):
+        # The Pinecone client is synchronous, so its latency blocks the event loop too
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        self._round_trip()
+        for vector in vectors:
+            self.vectors[vector["id"]] = vector
+
+    def query(self, vector: List[float], filter: Optional[Dict[str, Any]] = None, top_k: int = 10,
+              include_metadata: bool = False, include_values: bool = False) -> Dict[str, Any]:
+        self._round_trip()
+        filter = filter or {}
+        matches = []
+        for item in self.vectors.values():
+            metadata = item.get("metadata", {})
+            if any(metadata.get(key) != value for key, value in filter.items()):
+                continue
+            score = sum(a * b for a, b in zip(vector, item["values"]))
+            match = {"id": item["id"], "score": score}
+            if include_metadata:
+                match["metadata"] = metadata
+            if include_values:
+                match["values"] = item["values"]
+            matches.append(match)
+        matches.sort(key=lambda match: match["score"], reverse=True)
+        return {"matches": matches[:top_k]}
+
+    def fetch(self, ids: List[str]) -> Dict[str, Any]:
+        self._round_trip()
+        return {"vectors": {vector_id: self.vectors[vector_id] for vector_id in ids if vector_id in self.vectors}}
+
+    def delete(self, ids: List[str]):
+        self._round_trip()
+        for vector_id in ids:
+            self.vectors.pop(vector_id, None)
+
+def hashed_embedding(text: str, dimension: int = 256) -> List[float]:
+    """Bag-of-words feature hashing, so related texts land close together"""
+    vector = [0.0] * dimension
+    for word in text.lower().split():
+        digest = hashlib.md5(word.strip(".,!?").encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimension] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+class StubVectorStoreService(VectorStoreService):
+    """VectorStoreService backed by StubIndex and a local embedding function"""
+
+    def __init__(self, embedding_latency: float = 0.0, index_latency: float = 0.0, cache=None):
+        super().__init__(cache)
+        self.configured = True
+        self.index = StubIndex(index_latency)
+        self.embedding_latency = embedding_latency
+        self.embedding_calls = 0
+
+    async def _create_embedding(self, text: str) -> List[float]:
+        self.embedding_calls += 1
+        await asyncio.sleep(self.embedding_latency)
+        return hashed_embedding(text)
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self.embedding_calls += 1
+        await asyncio.sleep(self.embedding_latency)
+        return [hashed_embedding(text) for text in texts]
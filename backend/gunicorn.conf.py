@@ -0,0 +1,78 @@
+"""Production server: several uvicorn workers behind gunicorn, sharing one cache process.
+
+    gunicorn -c gunicorn.conf.py main:app
+"""
+import os
+import shutil
+import multiprocessing
+
+from services.shared_cache import start_server_process
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Workers finish in-flight requests before exiting
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Take the client address from X-Forwarded-For only when the request comes from the
+# proxy, which must overwrite the header (see nginx.conf); docker-compose pins nginx's address
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Recycle workers now and then so slow leaks can't build up; jitter avoids restarting them all at once
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+
+accesslog = "-"
+
+_cache_process = None
+_cache_starting = False
+
+def _ensure_cache_server(server):
+    """Start the shared cache process, or restart it if it has exited"""
+    global _cache_process, _cache_starting
+    # child_exit runs from the SIGCHLD handler, possibly while another hook is starting it
+    if _cache_starting:
+        return
+    if _cache_process is not None:
+        if _cache_process.poll() is None:
+            return
+        server.log.warning(f"Shared cache exited with code {_cache_process.returncode}, restarting it")
+    _cache_starting = True
+    try:
+        socket_path = os.environ["SHARED_CACHE_SOCKET"]
+        _cache_process = start_server_process(
+            socket_path, max_entries=int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "100000"))
+        )
+    finally:
+        _cache_starting = False
+    server.log.info(f"Shared cache started on {socket_path} (pid {_cache_process.pid})")
+
+def on_starting(server):
+    """Start the shared cache before any worker so every worker can reach it"""
+    # Admission control splits its global limits across this many workers
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    # Workers publish their metrics here so /metrics reports all of them
+    metrics_dir = os.environ.setdefault("METRICS_DIR", "/tmp/panda-metrics")
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    os.environ.setdefault("SHARED_CACHE_SOCKET", "/tmp/panda-cache.sock")
+    _ensure_cache_server(server)
+
+# The master checks on the cache whenever it reloads or replaces a worker (workers are
+# recycled every MAX_REQUESTS, so this happens regularly); workers ride out the gap
+# on their process-local fallback
+def on_reload(server):
+    _ensure_cache_server(server)
+
+def child_exit(server, worker):
+    _ensure_cache_server(server)
+
+def pre_fork(server, worker):
+    _ensure_cache_server(server)
+
+def on_exit(server):
+    if _cache_process is not None and _cache_process.poll() is None:
+        _cache_process.terminate()
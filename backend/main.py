@@ -1,24 +1,115 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, Request, status, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import firebase_admin
-from firebase_admin import credentials, auth
-import uvicorn
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 import uuid
 import json
+import asyncio
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional
 
 from models import *
+from services.auth_service import AuthService
 from services.database import DatabaseService
 from services.vector_store import VectorStoreService  
-from services.ai_service import AIService
+from services.ai_service import AIService, ANSWER_FALLBACK
 from services.file_service import FileService
+from services.admission import AdmissionController, AdmissionRejected
+from services.single_flight import SingleFlight, normalize_text
+from services.shared_cache import SharedCache
+from services.join_codes import JoinCodeIndex
+from services.archive_service import ArchiveService
+from services import metrics
+from middleware import MetricsMiddleware, CompressionMiddleware
 
 load_dotenv()
 
-app = FastAPI(title="PANDA API", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+# Services are built in the lifespan; anything assigned beforehand (e.g. a stand-in) is kept
+shared_cache = None
+auth_service = None
+db_service = None
+vector_service = None
+ai_service = None
+file_service = None
+join_code_index = None
+archive_service = None
+admission_controller = None
+request_flight = SingleFlight("requests")
+
+# Which dependencies have completed warm-up, reported by /health/ready
+readiness = {"auth": False, "database": False, "vector_store": False, "ai": False, "join_codes": False}
+
+async def warm_up():
+    """Connect to every dependency in parallel, retrying the ones that fail until all are ready"""
+    checks = {
+        "auth": auth_service.initialize,
+        "database": db_service.initialize,
+        "vector_store": vector_service.connect,
+        "ai": ai_service.warm_up,
+        "join_codes": join_code_index.load,
+    }
+    delay = 1.0
+    while True:
+        pending = [name for name, ready in readiness.items() if not ready]
+        if not pending:
+            logger.info("All services ready")
+            return
+        results = await asyncio.gather(*[checks[name]() for name in pending], return_exceptions=True)
+        for name, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Warm-up of {name} failed, retrying in {delay:.0f}s: {result}")
+            else:
+                readiness[name] = True
+        if not all(readiness.values()):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global shared_cache, auth_service, db_service, vector_service, ai_service, file_service, join_code_index
+    global archive_service, admission_controller
+    shared_cache = shared_cache or SharedCache.from_env()
+    auth_service = auth_service or AuthService(shared_cache)
+    db_service = db_service or DatabaseService(shared_cache)
+    vector_service = vector_service or VectorStoreService(shared_cache)
+    ai_service = ai_service or AIService()
+    file_service = file_service or FileService()
+    join_code_index = join_code_index or JoinCodeIndex(db_service, shared_cache)
+    archive_service = archive_service or ArchiveService(db_service, vector_service)
+    admission_controller = admission_controller or AdmissionController(shared_cache)
+    # Passages are built from the stored transcript, so every worker indexes the same way
+    vector_service.db = db_service
+    # Sessions missing from the hot collection are restored from their archive on first access
+    db_service.archive = archive_service
+
+    # Start serving (and answering liveness) right away; readiness follows warm-up
+    warm_up_task = asyncio.create_task(warm_up())
+    archive_task = asyncio.create_task(archive_service.run_periodically()) if archive_service.interval > 0 else None
+    # Under gunicorn every worker publishes its metrics so /metrics can report them all
+    metrics_dir = os.getenv("METRICS_DIR")
+    metrics_task = asyncio.create_task(
+        metrics.publish_periodically(metrics_dir, float(os.getenv("METRICS_SYNC_INTERVAL", "5")))
+    ) if metrics_dir else None
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        if archive_task:
+            archive_task.cancel()
+        if metrics_task:
+            metrics_task.cancel()
+            metrics.write_snapshot(metrics_dir)
+        await db_service.close()
+        await shared_cache.close()
+
+app = FastAPI(title="PANDA API", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS configuration
 app.add_middleware(
@@ -27,38 +118,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
-# Initialize Firebase Admin SDK
-firebase_config = {
-    "type": "service_account",
-    "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-    "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-    "private_key": os.getenv("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n'),
-    "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-    "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-    "token_uri": "https://oauth2.googleapis.com/token",
-}
-
-try:
-    cred = credentials.Certificate(firebase_config)
-    firebase_admin.initialize_app(cred)
-except Exception as e:
-    print(f"Firebase initialization error: {e}")
-
-# Initialize services
-db_service = DatabaseService()
-vector_service = VectorStoreService()
-ai_service = AIService()
-file_service = FileService()
+metrics.llm_in_flight.set_function(lambda: admission_controller.in_flight if admission_controller else 0)
+metrics.llm_queued.set_function(lambda: admission_controller.queued if admission_controller else 0)
 
 security = HTTPBearer()
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify Firebase token and return user info"""
     try:
-        decoded_token = auth.verify_id_token(credentials.credentials)
+        decoded_token = await auth_service.verify_token(credentials.credentials)
         user_id = decoded_token['uid']
         user = await db_service.get_user(user_id)
         if not user:
@@ -70,10 +143,44 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail=f"Invalid authentication credentials: {str(e)}"
         )
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    """Turn admission control rejections into 429 responses"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.get("/")
 async def root():
     return {"message": "PANDA API - Personalized AI for Notes, Discussion & Assistance"}
 
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: every dependency has finished warming up, plus LLM provider health"""
+    ready = all(readiness.values())
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ready" if ready else "starting",
+            "services": readiness,
+            "llm_providers": ai_service.router.snapshot() if ai_service else {}
+        }
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus-style metrics, merged across workers when they share METRICS_DIR"""
+    metrics_dir = os.getenv("METRICS_DIR")
+    body = await asyncio.to_thread(metrics.render_all, metrics_dir) if metrics_dir else metrics.registry.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 # Authentication endpoints
 @app.post("/auth/create-profile")
 async def create_profile(profile_data: UserCreate):
@@ -93,13 +200,13 @@ async def create_profile(profile_data: UserCreate):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/auth/profile")
+@app.get("/auth/profile", response_model=User)
 async def get_profile(current_user = Depends(get_current_user)):
     """Get current user profile"""
     return current_user
 
 # Session endpoints
-@app.post("/sessions/create")
+@app.post("/sessions/create", response_model=Session)
 async def create_session(current_user = Depends(get_current_user)):
     """Create a new session (speakers only)"""
     if current_user["role"] != "speaker":
@@ -119,18 +226,20 @@ async def create_session(current_user = Depends(get_current_user)):
     }
     
     session = await db_service.create_session(session_data)
+    await join_code_index.add(session)
     return session
 
-@app.get("/sessions/list")
+@app.get("/sessions/list", response_model=List[SessionSummary])
 async def list_sessions(current_user = Depends(get_current_user)):
     """List user's sessions"""
     sessions = await db_service.get_user_sessions(current_user["uid"])
     return sessions
 
-@app.post("/sessions/join")
+@app.post("/sessions/join", response_model=SessionSummary)
 async def join_session(join_data: JoinSessionRequest, current_user = Depends(get_current_user)):
     """Join a session using join code"""
-    session = await db_service.get_session_by_join_code(join_data.joinCode)
+    entry = await join_code_index.lookup(join_data.joinCode, client_id=current_user["uid"])
+    session = await db_service.get_session(entry["id"]) if entry else None
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -138,18 +247,31 @@ async def join_session(join_data: JoinSessionRequest, current_user = Depends(get
     await db_service.add_session_participant(session["id"], current_user["uid"])
     return session
 
-@app.get("/sessions/info/{join_code}")
-async def get_session_info(join_code: str):
+@app.get("/sessions/info/{join_code}", response_model=SessionInfo)
+async def get_session_info(join_code: str, request: Request):
     """Get session info by join code (public endpoint)"""
-    session = await db_service.get_session_by_join_code(join_code)
+    # Unauthenticated, so limit failed lookups per client to keep code scanning slow; behind
+    # the proxy the client address comes from X-Forwarded-For (see forwarded_allow_ips)
+    entry = await join_code_index.lookup(join_code, client_id=request.client.host if request.client else "unknown")
+    if not entry:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return entry
+
+@app.post("/sessions/{session_id}/end")
+async def end_session(session_id: str, current_user = Depends(get_current_user)):
+    """End a session (speaker only); ended sessions are archived after a grace period"""
+    session = await db_service.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    return {
-        "title": session["title"],
-        "speakerName": session["speakerName"],
-        "status": session["status"]
-    }
+    if session["speakerId"] != current_user["uid"]:
+        raise HTTPException(status_code=403, detail="Only session speaker can end the session")
+    
+    await db_service.end_session(session_id, archive_service.archive_after())
+    await vector_service.index_transcript(session_id, final=True)
+    await join_code_index.add({**session, "status": "ended"})
+    return {"message": "Session ended"}
 
 # Transcript endpoints
 @app.post("/sessions/{session_id}/transcript")
@@ -178,12 +300,12 @@ async def add_transcript(
     # Store in database
     await db_service.add_transcript_chunk(session_id, chunk)
     
-    # Store in vector database for RAG
-    await vector_service.store_transcript_chunk(session_id, chunk)
+    # Index passages this chunk completes in the vector database for RAG
+    await vector_service.index_transcript(session_id)
     
     return {"message": "Transcript added successfully"}
 
-@app.get("/sessions/{session_id}/transcript")
+@app.get("/sessions/{session_id}/transcript", response_model=TranscriptResponse)
 async def get_transcript(session_id: str, current_user = Depends(get_current_user)):
     """Get session transcript"""
     session = await db_service.get_session(session_id)
@@ -203,7 +325,7 @@ async def get_transcript(session_id: str, current_user = Depends(get_current_use
     return {"text": transcript_text}
 
 # Resource endpoints
-@app.post("/sessions/{session_id}/resources/upload")
+@app.post("/sessions/{session_id}/resources/upload", response_model=Resource)
 async def upload_resource(
     session_id: str,
     file: UploadFile = File(...),
@@ -252,7 +374,7 @@ async def set_active_resource(
     await db_service.set_active_resource(session_id, resource_id)
     return {"message": "Active resource updated"}
 
-@app.get("/sessions/{session_id}/resources/active")
+@app.get("/sessions/{session_id}/resources/active", response_model=Optional[Resource])
 async def get_active_resource(session_id: str, current_user = Depends(get_current_user)):
     """Get active resource for session"""
     session = await db_service.get_session(session_id)
@@ -272,7 +394,7 @@ async def get_active_resource(session_id: str, current_user = Depends(get_curren
     return active_resource
 
 # Task endpoints
-@app.post("/sessions/{session_id}/tasks")
+@app.post("/sessions/{session_id}/tasks", response_model=List[Task])
 async def generate_tasks(
     session_id: str,
     task_request: TaskGenerationRequest,
@@ -287,26 +409,51 @@ async def generate_tasks(
     if session["speakerId"] != current_user["uid"]:
         raise HTTPException(status_code=403, detail="Only session speaker can generate tasks")
     
-    # Generate tasks using AI
-    tasks = await ai_service.generate_tasks(task_request.transcript)
+    await admission_controller.check_rate(session_id, current_user["uid"], is_speaker=True)
+    
+    # Repeated submissions of the same transcript share one generation
+    transcript_hash = hashlib.sha1(task_request.transcript.encode("utf-8")).hexdigest()
+    return await request_flight.do(
+        ("tasks", session_id, transcript_hash),
+        lambda: create_session_tasks(session_id, task_request.transcript)
+    )
+
+def normalize_task(task_data: Any, generated: bool = False) -> Optional[Dict[str, Any]]:
+    """Fit a stored or generated task to the Task model; None when it has no usable title.
+    
+    Generated tasks always get a new id and start out open.
+    """
+    if not isinstance(task_data, dict) or not isinstance(task_data.get("title"), str) or not task_data["title"].strip():
+        return None
+    priority = str(task_data.get("priority") or "").strip().lower()
+    stored = {} if generated else task_data
+    return {
+        "id": str(stored.get("id") or uuid.uuid4()),
+        "title": task_data["title"].strip(),
+        "description": str(task_data.get("description") or ""),
+        "completed": bool(stored.get("completed", False)),
+        "createdAt": str(stored.get("createdAt") or datetime.utcnow().isoformat()),
+        "priority": priority if priority in ("low", "medium", "high") else "medium"
+    }
+
+async def create_session_tasks(session_id: str, transcript: str) -> List[Dict[str, Any]]:
+    """Generate tasks using AI and store them on the session"""
+    async with admission_controller.slot(session_id, is_speaker=True):
+        tasks = await ai_service.generate_tasks(transcript)
     
-    # Store tasks
+    # Store tasks; model output is free-form, so skip items that aren't tasks
     task_objects = []
-    for task_data in tasks:
-        task = {
-            "id": str(uuid.uuid4()),
-            "title": task_data["title"],
-            "description": task_data["description"],
-            "completed": False,
-            "createdAt": datetime.utcnow().isoformat(),
-            "priority": task_data.get("priority", "medium")
-        }
+    for task_data in tasks if isinstance(tasks, list) else []:
+        task = normalize_task(task_data, generated=True)
+        if task is None:
+            logger.warning(f"Dropping malformed generated task: {task_data!r}")
+            continue
         task_objects.append(task)
     
     await db_service.set_session_tasks(session_id, task_objects)
     return task_objects
 
-@app.get("/sessions/{session_id}/tasks")
+@app.get("/sessions/{session_id}/tasks", response_model=List[Task])
 async def get_tasks(session_id: str, current_user = Depends(get_current_user)):
     """Get session tasks"""
     session = await db_service.get_session(session_id)
@@ -322,7 +469,8 @@ async def get_tasks(session_id: str, current_user = Depends(get_current_user)):
     if not has_access:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return session.get("tasks", [])
+    # Tasks stored before generation output was normalized may not fit the Task model
+    return [task for task in map(normalize_task, session.get("tasks", [])) if task]
 
 # Chat/Query endpoints
 @app.post("/sessions/{session_id}/query")
@@ -345,13 +493,44 @@ async def query_session(
     if not has_access:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Get relevant context from vector store
-    context = await vector_service.query_similar_content(session_id, query_request.message)
-    
-    # Generate answer using AI
-    answer = await ai_service.generate_answer(query_request.message, context)
+    # Answers stay valid until the transcript grows, so its length is part of the key
+    question = normalize_text(query_request.message)
+    answer_key = "answer:{}:{}:{}".format(
+        session_id, len(session.get("transcript", [])), hashlib.sha1(question.encode("utf-8")).hexdigest()
+    )
+    answer = await shared_cache.get(answer_key)
+    if answer:
+        return {"answer": answer}
+    
+    is_speaker = session["speakerId"] == current_user["uid"]
+    await admission_controller.check_rate(session_id, current_user["uid"], is_speaker=is_speaker)
+    # Speech not yet indexed as a passage is added to the retrieved context
+    pending = vector_service.aggregator.pending_chunks(session.get("transcript", []), session.get("indexedThrough"))
+    
+    # Identical questions asked at the same moment share one answer
+    answer = await request_flight.do(
+        ("query", session_id, question),
+        lambda: answer_question(session_id, query_request.message, is_speaker, answer_key, pending)
+    )
     
     return {"answer": answer}
 
+async def answer_question(
+    session_id: str, message: str, is_speaker: bool, answer_key: str, pending: List[Dict[str, Any]]
+) -> str:
+    """Retrieve session context, generate an answer and cache it for every worker"""
+    async with admission_controller.slot(session_id, is_speaker=is_speaker):
+        # Get relevant context from vector store
+        context = await vector_service.query_similar_chunks(session_id, message, pending=pending)
+        
+        # Generate answer using AI
+        answer = await ai_service.generate_answer(message, context)
+    
+    if answer != ANSWER_FALLBACK:
+        await shared_cache.set(answer_key, answer, float(os.getenv("ANSWER_CACHE_TTL", "600")))
+    return answer
+
 if __name__ == "__main__":
+    import uvicorn
+    
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
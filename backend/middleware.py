@@ -0,0 +1,180 @@
+import os
+import gzip
+import time
+import logging
+import random
+from pathlib import Path
+from typing import Dict, Callable, Optional
+
+from starlette.datastructures import MutableHeaders
+
+from services import metrics
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # pragma: no cover - optional dependency
+    Profiler = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+class MetricsMiddleware:
+    """Record request latency, in-flight requests and a Server-Timing header for each HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Callable, str] = {}
+        # Sampled requests slower than this are profiled (requires pyinstrument)
+        self.profile_slow_ms = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+        self.profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+        self.profile_dir = Path(os.getenv("PROFILE_DIR", "profiles"))
+
+    def _route_path(self, scope) -> str:
+        """Route template (e.g. /sessions/{session_id}/query) to keep label cardinality bounded"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if not self._routes:
+            app = scope.get("app")
+            for route in getattr(app, "routes", []):
+                if hasattr(route, "endpoint"):
+                    self._routes[route.endpoint] = route.path
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        token = metrics.start_request_timings()
+        metrics.http_requests_in_flight.inc()
+        status_code = 500
+
+        profiler = None
+        if Profiler and self.profile_slow_ms and random.random() < self.profile_sample_rate:
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                timings = metrics.current_request_timings()
+                header = metrics.server_timing_header(timings, time.perf_counter() - started)
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.finish_request_timings(token)
+            metrics.http_requests_in_flight.dec()
+            metrics.http_request_duration.observe(
+                elapsed, method=scope["method"], route=self._route_path(scope), status=str(status_code)
+            )
+            if profiler:
+                profiler.stop()
+                if elapsed * 1000 >= self.profile_slow_ms:
+                    self._save_profile(profiler, scope, elapsed)
+
+    def _save_profile(self, profiler, scope, elapsed: float):
+        try:
+            self.profile_dir.mkdir(exist_ok=True)
+            name = f"{int(time.time() * 1000)}-{scope['method']}-{int(elapsed * 1000)}ms.html"
+            (self.profile_dir / name).write_text(profiler.output_html())
+        except Exception as e:
+            logger.error(f"Error saving request profile: {e}")
+
+class CompressionMiddleware:
+    """Compress JSON and text responses above a size threshold with brotli or gzip, as the client accepts"""
+
+    compressible_types = ("application/json", "text/")
+
+    def __init__(self, app, minimum_size: Optional[int] = None, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = int(os.getenv("COMPRESSION_MIN_BYTES", "1024")) if minimum_size is None else minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ("br", "gzip") if brotli else ("gzip",)
+
+    def _negotiate(self, scope) -> Optional[str]:
+        """Pick the supported encoding with the highest q-value, preferring brotli on ties"""
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1").lower()
+                break
+
+        weights = {}
+        for part in accept.split(","):
+            coding, _, params = part.strip().partition(";")
+            q = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            weights[coding.strip()] = q
+
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = weights.get(encoding, weights.get("*", 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        encoding = self._negotiate(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the body shows whether it's worth compressing
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = MutableHeaders(scope=start_message)
+            content_type = headers.get("content-type", "")
+            # Streamed bodies (e.g. files) and small or already encoded responses go out as they are
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not content_type.startswith(self.compressible_types)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            with metrics.timed(f"compress.{encoding}"):
+                body = self._compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -52,6 +52,25 @@ class Session(BaseModel):
     joinCode: str
     participants: List[str] = []
 
+class SessionSummary(BaseModel):
+    """Session as shown in listings, without transcript, resources or tasks"""
+    id: str
+    title: str
+    speakerId: str
+    speakerName: str
+    status: Literal["active", "ended"] = "active"
+    createdAt: str
+    joinCode: str
+
+class SessionInfo(BaseModel):
+    """Public view of a session, looked up by join code"""
+    title: str
+    speakerName: str
+    status: Literal["active", "ended"] = "active"
+
+class TranscriptResponse(BaseModel):
+    text: str
+
 class JoinSessionRequest(BaseModel):
     joinCode: str
 
@@ -0,0 +1,129 @@
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from services import metrics
+from services.shared_cache import SharedCache
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint in seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class AdmissionController:
+    """Rate limit and queue LLM-backed requests so overload turns into waiting, not provider errors"""
+
+    def __init__(self, cache: SharedCache):
+        # Slot and queue limits are deployment-wide; each worker process takes an equal share
+        workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+        self.max_in_flight = max(1, math.ceil(int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "16")) / workers))
+        self.max_queue = max(1, math.ceil(int(os.getenv("ADMISSION_MAX_QUEUE", "200")) / workers))
+        self.max_wait = float(os.getenv("ADMISSION_MAX_WAIT", "15"))
+        self.user_rate = float(os.getenv("ADMISSION_USER_PER_MINUTE", "12")) / 60
+        self.user_burst = float(os.getenv("ADMISSION_USER_BURST", "3"))
+        self.session_rate = float(os.getenv("ADMISSION_SESSION_PER_MINUTE", "240")) / 60
+        self.session_burst = float(os.getenv("ADMISSION_SESSION_BURST", "40"))
+        # Rate buckets live in the shared cache so every worker charges the same ones
+        self.cache = cache
+
+        self.in_flight = 0
+        self.queued = 0
+        # Speaker requests jump the queue; everyone else is served round-robin by session
+        self._priority = deque()
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()
+        self._service_time = 1.0
+
+    async def check_rate(self, session_id: str, user_id: str, is_speaker: bool = False):
+        """Charge the per-user and per-session buckets or raise AdmissionRejected"""
+        wait = await self.cache.take(f"rate:user:{user_id}", self.user_rate, self.user_burst)
+        if wait:
+            metrics.admission_rejections.inc(reason="user_rate")
+            raise AdmissionRejected("Too many requests, please slow down", wait)
+
+        if not is_speaker:
+            wait = await self.cache.take(f"rate:session:{session_id}", self.session_rate, self.session_burst)
+            if wait:
+                metrics.admission_rejections.inc(reason="session_rate")
+                raise AdmissionRejected("This session is receiving too many requests", wait)
+
+    def _retry_estimate(self) -> float:
+        return self._service_time * (self.queued + 1) / max(1, self.max_in_flight)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        while self._priority:
+            waiter = self._priority.popleft()
+            if not waiter.done():
+                return waiter
+
+        while self._waiting:
+            session_id, waiters = next(iter(self._waiting.items()))
+            waiter = None
+            while waiters:
+                candidate = waiters.popleft()
+                if not candidate.done():
+                    waiter = candidate
+                    break
+            if waiters:
+                self._waiting.move_to_end(session_id)
+            else:
+                del self._waiting[session_id]
+            if waiter:
+                return waiter
+        return None
+
+    def _release(self):
+        self.in_flight -= 1
+        while self.in_flight < self.max_in_flight:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.in_flight += 1
+            self.queued -= 1
+            waiter.set_result(None)
+
+    async def _acquire(self, session_id: str, is_speaker: bool):
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            return
+
+        if self.queued >= self.max_queue and not is_speaker:
+            metrics.admission_rejections.inc(reason="queue_full")
+            raise AdmissionRejected("Server is busy, please retry shortly", self._retry_estimate())
+
+        waiter = asyncio.get_running_loop().create_future()
+        if is_speaker:
+            self._priority.append(waiter)
+        else:
+            self._waiting.setdefault(session_id, deque()).append(waiter)
+        self.queued += 1
+
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just as we gave up; pass it on
+                self._release()
+            else:
+                self.queued -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.admission_rejections.inc(reason="queue_timeout")
+                raise AdmissionRejected("Server is busy, please retry shortly", self._retry_estimate())
+            raise
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, is_speaker: bool = False):
+        """Hold one of the in-flight slots, waiting in the fair queue if needed"""
+        with metrics.timed("admission.wait"):
+            await self._acquire(session_id, is_speaker)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._release()
@@ -1,32 +1,37 @@
-import os
-import openai
-import google.generativeai as genai
-from typing import List, Dict, Any, Optional
 import json
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, Union
+
+from services.context_builder import ContextBuilder, load_tokenizer
+from services.llm_router import LLMRouter
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+ANSWER_FALLBACK = "I apologize, but I'm having trouble processing your question right now. Please try asking the speaker directly."
 
 class AIService:
-    def __init__(self):
-        self.openai_key = os.getenv("OPENAI_API_KEY")
-        self.gemini_key = os.getenv("GEMINI_API_KEY")
-        self.use_openai = True  # Default to OpenAI
-        
-        if self.openai_key:
-            openai.api_key = self.openai_key
-        elif self.gemini_key:
-            genai.configure(api_key=self.gemini_key)
-            self.model = genai.GenerativeModel('gemini-pro')
-            self.use_openai = False
-        else:
-            print("No AI API keys configured - using mock responses")
+    def __init__(self, router: Optional[LLMRouter] = None):
+        self.router = router or LLMRouter.from_env()
+        self.context_builder = ContextBuilder()
+        
+        if not self.router.providers:
+            logger.warning("No AI API keys configured - using mock responses")
     
-    async def generate_answer(self, question: str, context: List[str]) -> str:
-        """Generate answer based on question and context"""
-        if not self.openai_key and not self.gemini_key:
+    async def warm_up(self):
+        """Load provider SDKs and the tokenizer before the first request needs them"""
+        await asyncio.gather(self.router.warm_up(), asyncio.to_thread(load_tokenizer))
+    
+    async def generate_answer(self, question: str, context: List[Union[str, Dict[str, Any]]]) -> str:
+        """Generate answer based on question and retrieved context chunks"""
+        if not self.router.providers:
             # Mock response for development
             return f"Based on the session content, here's what I understand about your question: '{question}'. This is a mock response for development purposes."
         
-        # Prepare context
-        context_text = "\n\n".join(context) if context else "No specific context available."
+        # Prepare context within the token budget
+        context_text = self.context_builder.build(context) if context else ""
+        context_text = context_text or "No specific context available."
         
         prompt = f"""
         You are an AI assistant helping students and participants understand session content.
@@ -41,31 +46,20 @@ class AIService:
         """
         
         try:
-            if self.use_openai and self.openai_key:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful AI assistant for educational sessions."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=300,
-                    temperature=0.7
-                )
-                return response.choices[0].message.content.strip()
-            
-            elif not self.use_openai and self.gemini_key:
-                response = self.model.generate_content(prompt)
-                return response.text.strip()
-                
+            return await self.router.complete(
+                prompt,
+                system="You are a helpful AI assistant for educational sessions.",
+                max_tokens=300,
+                temperature=0.7
+            )
         except Exception as e:
-            print(f"Error generating answer: {e}")
-            return "I apologize, but I'm having trouble processing your question right now. Please try asking the speaker directly."
-        
-        return "I don't have enough information to answer that question. Please ask the speaker for clarification."
+            logger.error(f"Error generating answer: {e}")
+            metrics.fallbacks.inc(kind="answer")
+            return ANSWER_FALLBACK
     
     async def generate_tasks(self, transcript: str) -> List[Dict[str, Any]]:
         """Generate tasks and action items from transcript"""
-        if not self.openai_key and not self.gemini_key:
+        if not self.router.providers:
             # Mock response for development
             return [
                 {
@@ -101,33 +95,22 @@ class AIService:
         """
         
         try:
-            if self.use_openai and self.openai_key:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are an expert at creating educational tasks and action items. Always respond with valid JSON."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=500,
-                    temperature=0.7
-                )
-                
-                # Parse JSON response
-                tasks_json = response.choices[0].message.content.strip()
-                return json.loads(tasks_json)
+            tasks_json = await self.router.complete(
+                prompt,
+                system="You are an expert at creating educational tasks and action items. Always respond with valid JSON.",
+                max_tokens=500,
+                temperature=0.7
+            )
             
-            elif not self.use_openai and self.gemini_key:
-                response = self.model.generate_content(prompt)
-                tasks_json = response.text.strip()
-                
-                # Clean up response if it contains markdown
-                if "```json" in tasks_json:
-                    tasks_json = tasks_json.split("```json")[1].split("```")[0].strip()
-                
-                return json.loads(tasks_json)
+            # Clean up response if it contains markdown
+            if "```json" in tasks_json:
+                tasks_json = tasks_json.split("```json")[1].split("```")[0].strip()
+            
+            return json.loads(tasks_json)
                 
         except Exception as e:
-            print(f"Error generating tasks: {e}")
+            logger.error(f"Error generating tasks: {e}")
+            metrics.fallbacks.inc(kind="tasks")
             # Return fallback tasks
             return [
                 {
@@ -141,12 +124,10 @@ class AIService:
                     "priority": "low"
                 }
             ]
-        
-        return []
     
     async def summarize_transcript(self, transcript: str) -> str:
         """Generate a summary of the transcript"""
-        if not self.openai_key and not self.gemini_key:
+        if not self.router.providers:
             return "This is a mock summary of the session transcript for development purposes."
         
         prompt = f"""
@@ -159,24 +140,13 @@ class AIService:
         """
         
         try:
-            if self.use_openai and self.openai_key:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are an expert at summarizing educational content."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=300,
-                    temperature=0.5
-                )
-                return response.choices[0].message.content.strip()
-            
-            elif not self.use_openai and self.gemini_key:
-                response = self.model.generate_content(prompt)
-                return response.text.strip()
-                
+            return await self.router.complete(
+                prompt,
+                system="You are an expert at summarizing educational content.",
+                max_tokens=300,
+                temperature=0.5
+            )
         except Exception as e:
-            print(f"Error generating summary: {e}")
-            return "Unable to generate summary at this time."
-        
-        return "No summary available."
\ No newline at end of file
+            logger.error(f"Error generating summary: {e}")
+            metrics.fallbacks.inc(kind="summary")
+            return "Unable to generate summary at this time."
\ No newline at end of file
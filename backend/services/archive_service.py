@@ -0,0 +1,153 @@
+import os
+import gzip
+import json
+import asyncio
+import logging
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from services import metrics
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Session fields written as one archive record per item rather than inside the session record
+ITEM_FIELDS = (("transcript", "transcript"), ("tasks", "task"), ("resources", "resource"))
+
+class ArchiveService:
+    """Move ended sessions into gzipped JSONL files on local disk and restore them when opened"""
+
+    def __init__(self, db_service, vector_service):
+        self.db = db_service
+        self.vectors = vector_service
+        self.archive_dir = Path(os.getenv("ARCHIVE_DIR", "archive"))
+        self.grace = timedelta(hours=float(os.getenv("ARCHIVE_AFTER_HOURS", "24")))
+        self.interval = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+        self.claim_timeout = timedelta(hours=1)
+        self.restore_flight = SingleFlight("archive_restore")
+
+    def archive_after(self) -> str:
+        """When a session ended (or restored) now becomes due for archiving"""
+        return (datetime.utcnow() + self.grace).isoformat()
+
+    def _records(self, session: Dict[str, Any], vectors: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        header = {key: value for key, value in session.items() if key not in dict(ITEM_FIELDS)}
+        yield {"type": "session", "data": header}
+        for field, kind in ITEM_FIELDS:
+            for item in session.get(field, []):
+                yield {"type": kind, "data": item}
+        for vector in vectors:
+            yield {"type": "vector", "data": vector}
+
+    def _write_archive(self, path: Path, session: Dict[str, Any], vectors: List[Dict[str, Any]]):
+        """Stream records into a temporary file and move it into place once it is on disk"""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".partial")
+        with open(partial, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+                for record in self._records(session, vectors):
+                    archive.write(json.dumps(record, separators=(",", ":"), default=str).encode("utf-8") + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(partial, path)
+
+    def _read_archive(self, path: Path) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        session: Dict[str, Any] = {field: [] for field, _ in ITEM_FIELDS}
+        vectors = []
+        fields = {kind: field for field, kind in ITEM_FIELDS}
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            for line in archive:
+                record = json.loads(line)
+                if record["type"] == "session":
+                    session.update(record["data"])
+                elif record["type"] == "vector":
+                    vectors.append(record["data"])
+                else:
+                    session[fields[record["type"]]].append(record["data"])
+        return session, vectors
+
+    async def archive_session(self, session: Dict[str, Any]) -> bool:
+        """Write a claimed session and its vectors to its archive file, then drop them from hot storage.
+        
+        Returns False if the session was written to meanwhile; it stays hot and is archived later.
+        """
+        session_id = session["id"]
+        claimed_at = session.pop("archivingAt")
+        indexed_through = await self.vectors.index_transcript(session_id, final=True)
+        if indexed_through:
+            session["indexedThrough"] = indexed_through
+        vectors = await self.vectors.export_session_vectors(session_id, session.get("transcript", []))
+
+        # The pointer holds only the file name, resolved against ARCHIVE_DIR on restore
+        path = self.archive_dir / f"{session_id}.jsonl.gz"
+        with metrics.timed("archive.write"):
+            await asyncio.to_thread(self._write_archive, path, session, vectors)
+
+        if not await self.db.replace_with_archive_pointer(session, path.name, claimed_at):
+            # Still in use: restart its grace period rather than reclaim it straight away
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+            await self.db.end_session(session_id, self.archive_after())
+            metrics.archive_events.inc(action="aborted")
+            return False
+        await self.vectors.delete_session_data(session_id, session.get("transcript", []))
+        metrics.archive_events.inc(action="archived")
+        return True
+
+    async def archive_ended_sessions(self, limit: Optional[int] = None) -> int:
+        """Archive ended sessions that are due, one at a time; return how many were archived"""
+        archived = 0
+        while limit is None or archived < limit:
+            stale_claim_before = (datetime.utcnow() - self.claim_timeout).isoformat()
+            session = await self.db.claim_session_for_archive(stale_claim_before)
+            if session is None:
+                break
+            try:
+                if await self.archive_session(session):
+                    archived += 1
+            except Exception as e:
+                # The claim expires, so a later pass retries this session
+                logger.error(f"Error archiving session {session['id']}: {e}")
+                metrics.archive_events.inc(action="failed")
+        return archived
+
+    async def run_periodically(self):
+        """Archive due sessions every ARCHIVE_INTERVAL seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                archived = await self.archive_ended_sessions()
+                if archived:
+                    logger.info(f"Archived {archived} ended sessions")
+            except Exception as e:
+                logger.error(f"Error during session archiving: {e}")
+
+    async def restore(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Bring an archived session back into hot storage; None if it was never archived"""
+        return await self.restore_flight.do(session_id, lambda: self._restore(session_id))
+
+    async def _restore(self, session_id: str) -> Optional[Dict[str, Any]]:
+        pointer = await self.db.get_archive_pointer(session_id)
+        if pointer is None:
+            return None
+
+        try:
+            with metrics.timed("archive.restore"):
+                session, vectors = await asyncio.to_thread(self._read_archive, self.archive_dir / pointer["archiveFile"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error reading archive of session {session_id}: {e}")
+            metrics.archive_events.inc(action="failed")
+            return None
+
+        # Restart the grace period so an opened session isn't archived again straight away
+        session["archiveAfter"] = self.archive_after()
+        try:
+            await self.vectors.restore_session_vectors(vectors)
+            await self.db.restore_session(session)
+        except Exception as e:
+            # The pointer and archive file stay, so the next access retries the restore
+            logger.error(f"Error restoring session {session_id}: {e}")
+            metrics.archive_events.inc(action="failed")
+            raise
+        metrics.archive_events.inc(action="restored")
+        return session
@@ -0,0 +1,70 @@
+import os
+import time
+import asyncio
+import hashlib
+from typing import Dict, Any, Optional
+
+from services import metrics
+from services.shared_cache import SharedCache
+
+class AuthService:
+    """Firebase Admin wrapper that initializes lazily and verifies tokens off the event loop"""
+
+    def __init__(self, cache: Optional[SharedCache] = None):
+        self._auth = None
+        self._lock = asyncio.Lock()
+        self.cache = cache
+        self.cache_ttl = float(os.getenv("AUTH_CACHE_TTL", "300"))
+
+    @property
+    def ready(self) -> bool:
+        return self._auth is not None
+
+    def _initialize_app(self):
+        # Imported here so workers don't pay for the SDK until it's needed
+        import firebase_admin
+        from firebase_admin import credentials, auth
+
+        firebase_config = {
+            "type": "service_account",
+            "project_id": os.getenv("FIREBASE_PROJECT_ID"),
+            "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
+            "private_key": os.getenv("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n'),
+            "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
+            "client_id": os.getenv("FIREBASE_CLIENT_ID"),
+            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }
+
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(firebase_config)
+            firebase_admin.initialize_app(cred)
+        self._auth = auth
+
+    async def initialize(self):
+        """Initialize the Firebase Admin SDK once"""
+        if self._auth:
+            return
+        async with self._lock:
+            if not self._auth:
+                await asyncio.to_thread(self._initialize_app)
+
+    async def verify_token(self, token: str) -> Dict[str, Any]:
+        """Verify a Firebase ID token and return its decoded claims"""
+        # Keyed by a digest so raw tokens never sit in the cache
+        cache_key = "auth:" + hashlib.sha256(token.encode("utf-8")).hexdigest()
+        if self.cache:
+            claims = await self.cache.get(cache_key, local_ttl=60)
+            if claims and claims.get("exp", 0) > time.time():
+                return claims
+
+        await self.initialize()
+        with metrics.timed("auth.verify_token"):
+            claims = await asyncio.to_thread(self._auth.verify_id_token, token)
+
+        if self.cache:
+            # Never keep a token around past its own expiry
+            ttl = min(self.cache_ttl, claims.get("exp", 0) - time.time())
+            if ttl > 0:
+                await self.cache.set(cache_key, claims, ttl, local_ttl=60)
+        return claims
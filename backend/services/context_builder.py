@@ -0,0 +1,178 @@
+import os
+import re
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Union
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def load_tokenizer(blocking: bool = True):
+    """Load the tokenizer once per process; None when it is unavailable.
+
+    tiktoken reads its BPE file from TIKTOKEN_CACHE_DIR, which the Docker image
+    fills at build time, so loading it needs no network access. Without blocking,
+    None is returned while another thread (warm-up) is still loading it.
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    # Request paths run on the event loop, so they use the word estimate rather than wait
+    if not _encoding_lock.acquire(blocking=blocking):
+        return None
+    try:
+        if not _encoding_loaded:
+            if tiktoken:
+                try:
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.warning(f"Tokenizer unavailable, using word count estimate: {e}")
+            _encoding_loaded = True
+    finally:
+        _encoding_lock.release()
+    return _encoding
+
+class ContextBuilder:
+    """Pack retrieved transcript chunks into a token-budgeted prompt context"""
+
+    def __init__(self):
+        self.token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+        self.duplicate_threshold = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+        self.min_overlap_words = int(os.getenv("CONTEXT_MIN_OVERLAP_WORDS", "4"))
+        self.separator = "\n\n"
+
+    @property
+    def _encoding(self):
+        return load_tokenizer(blocking=False)
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens with the local tokenizer (or a word-level estimate)"""
+        if self._encoding:
+            return len(self._encoding.encode(text))
+        return len(_WORD_RE.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text down to at most max_tokens tokens"""
+        if max_tokens <= 0:
+            return ""
+        if self._encoding:
+            tokens = self._encoding.encode(text)
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens])
+
+        matches = list(_WORD_RE.finditer(text))
+        if len(matches) <= max_tokens:
+            return text
+        return text[:matches[max_tokens - 1].end()]
+
+    def build(self, chunks: List[Union[str, Dict[str, Any]]], token_budget: Optional[int] = None) -> str:
+        """Dedupe, merge and pack chunks into a single context string"""
+        budget = token_budget or self.token_budget
+        items = self._normalize(chunks)
+        items = self._drop_duplicates(items)
+        items = self._merge_adjacent(items)
+        selected = self._select(items, budget)
+
+        # Present the selected chunks in the order they were spoken
+        selected.sort(key=lambda item: (item["timestamp"] or "", item["rank"]))
+        return self.separator.join(item["text"] for item in selected)
+
+    def _normalize(self, chunks: List[Union[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Turn raw strings or vector matches into uniform chunk dicts"""
+        items = []
+        for rank, chunk in enumerate(chunks):
+            if isinstance(chunk, str):
+                chunk = {"text": chunk}
+
+            text = " ".join((chunk.get("text") or "").split())
+            if not text:
+                continue
+
+            items.append({
+                "text": text,
+                "timestamp": chunk.get("timestamp"),
+                # Plain strings arrive best-first, so rank stands in for a score
+                "score": chunk.get("score", 1.0 / (rank + 1)),
+                "rank": rank,
+                "words": text.lower().split()
+            })
+        return items
+
+    def _shingles(self, words: List[str]) -> set:
+        if len(words) < 3:
+            return {tuple(words)}
+        return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+    def _drop_duplicates(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Collapse near-duplicate chunks, keeping the most relevant copy"""
+        kept = []
+        for item in sorted(items, key=lambda i: -i["score"]):
+            shingles = self._shingles(item["words"])
+            duplicate = False
+            for other in kept:
+                other_shingles = other["shingles"]
+                overlap = len(shingles & other_shingles)
+                smaller = min(len(shingles), len(other_shingles)) or 1
+                union = len(shingles | other_shingles) or 1
+                # Either near-identical or fully contained in an already kept chunk
+                if overlap / union >= self.duplicate_threshold or (
+                    overlap == len(shingles) and overlap / smaller >= self.duplicate_threshold
+                ):
+                    duplicate = True
+                    break
+            if not duplicate:
+                item["shingles"] = shingles
+                kept.append(item)
+        return kept
+
+    def _overlap_length(self, left: List[str], right: List[str]) -> int:
+        """Length of the longest suffix of left that is a prefix of right"""
+        for size in range(min(len(left), len(right)) - 1, self.min_overlap_words - 1, -1):
+            if left[-size:] == right[:size]:
+                return size
+        return 0
+
+    def _merge_adjacent(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Join chunks whose text runs on from one another into one passage"""
+        ordered = sorted(items, key=lambda i: (i["timestamp"] or "", i["rank"]))
+        merged = []
+        for item in ordered:
+            if merged:
+                previous = merged[-1]
+                overlap = self._overlap_length(previous["words"], item["words"])
+                if overlap:
+                    tail = item["text"].split()[overlap:]
+                    previous["text"] = " ".join([previous["text"]] + tail)
+                    previous["words"] = previous["words"] + item["words"][overlap:]
+                    previous["score"] = max(previous["score"], item["score"])
+                    previous["rank"] = min(previous["rank"], item["rank"])
+                    continue
+            merged.append(item)
+        return merged
+
+    def _select(self, items: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+        """Fill the token budget greedily by relevance"""
+        separator_tokens = self.count_tokens(self.separator)
+        selected = []
+        used = 0
+        for item in sorted(items, key=lambda i: (-i["score"], i["rank"])):
+            cost = self.count_tokens(item["text"]) + (separator_tokens if selected else 0)
+            if used + cost <= budget:
+                selected.append(item)
+                used += cost
+            elif not selected:
+                # Never send an empty context just because the best chunk is long
+                item["text"] = self.truncate(item["text"], budget)
+                selected.append(item)
+                used = budget
+        return selected
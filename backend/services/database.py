@@ -1,14 +1,31 @@
 import os
+import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
+from services.metrics import instrumented
+from services.shared_cache import SharedCache
+
+# Fields of models.SessionSummary; listings never load transcripts, resources or tasks
+SESSION_SUMMARY_PROJECTION = {
+    "_id": 0, "id": 1, "title": 1, "speakerId": 1, "speakerName": 1,
+    "status": 1, "createdAt": 1, "joinCode": 1
+}
+
 class DatabaseService:
-    def __init__(self):
+    def __init__(self, cache: Optional[SharedCache] = None):
         self.mongo_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
         self.db_name = os.getenv("MONGODB_DB_NAME", "panda")
         self.client = None
         self.db = None
+        self.cache = cache
+        self.session_cache_ttl = float(os.getenv("SESSION_CACHE_TTL", "30"))
+        self.user_cache_ttl = float(os.getenv("USER_CACHE_TTL", "300"))
+        self._pending_invalidations = set()
+        # Set to the ArchiveService so get_session can bring archived sessions back
+        self.archive = None
         self._initialize()
     
     def _initialize(self):
@@ -16,110 +33,274 @@ class DatabaseService:
         self.client = AsyncIOMotorClient(self.mongo_url)
         self.db = self.client[self.db_name]
     
+    async def ping(self):
+        """Round-trip to the server to confirm the connection is usable"""
+        await self.db.command("ping")
+    
+    async def initialize(self):
+        """Confirm the connection and create the indexes lookups rely on"""
+        await self.ping()
+        await self.db.sessions.create_index("id", unique=True)
+        await self.db.sessions.create_index("joinCode")
+        await self.db.sessions.create_index([("status", 1), ("archiveAfter", 1)])
+        await self.db.archived_sessions.create_index("id", unique=True)
+        await self.db.archived_sessions.create_index("joinCode")
+        await self.db.users.create_index("uid", unique=True)
+    
+    async def _invalidate_session(self, session_id: str):
+        """Drop the cached copy of a session after a write"""
+        if not self.cache:
+            return
+        key = f"session:{session_id}"
+        await self.cache.delete(key)
+        
+        # A read that raced the write may re-cache the old document, so delete once more shortly after
+        task = asyncio.create_task(self._delete_later(key, 1.0))
+        self._pending_invalidations.add(task)
+        task.add_done_callback(self._pending_invalidations.discard)
+    
+    async def _delete_later(self, key: str, delay: float):
+        await asyncio.sleep(delay)
+        await self.cache.delete(key)
+    
+    @instrumented("db.create_user")
     async def create_user(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new user"""
         await self.db.users.insert_one(user_data)
+        if self.cache:
+            await self.cache.delete(f"user:{user_data['uid']}")
         return user_data
     
+    @instrumented("db.get_user")
     async def get_user(self, uid: str) -> Optional[Dict[str, Any]]:
         """Get user by UID"""
+        if self.cache:
+            user = await self.cache.get(f"user:{uid}", local_ttl=30)
+            if user:
+                return user
+        
         user = await self.db.users.find_one({"uid": uid})
         if user:
             user.pop('_id', None)
+            if self.cache:
+                await self.cache.set(f"user:{uid}", user, self.user_cache_ttl, local_ttl=30)
         return user
     
+    @instrumented("db.create_session")
     async def create_session(self, session_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new session"""
         await self.db.sessions.insert_one(session_data)
         return session_data
     
+    @instrumented("db.get_session")
     async def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get session by ID"""
+        # Sessions change with every transcript chunk, so they skip the per-worker L1
+        # and live only in the shared tier, where writes invalidate them for every worker
+        if self.cache:
+            session = await self.cache.get(f"session:{session_id}")
+            if session:
+                return session
+        
         session = await self.db.sessions.find_one({"id": session_id})
         if session:
             session.pop('_id', None)
+            if self.cache:
+                await self.cache.set(f"session:{session_id}", session, self.session_cache_ttl)
+        elif self.archive:
+            session = await self.archive.restore(session_id)
         return session
     
-    async def get_session_by_join_code(self, join_code: str) -> Optional[Dict[str, Any]]:
-        """Get session by join code"""
-        session = await self.db.sessions.find_one({"joinCode": join_code})
-        if session:
-            session.pop('_id', None)
-        return session
+    @instrumented("db.get_join_code_info")
+    async def get_join_code_info(self, join_code: str) -> Optional[Dict[str, Any]]:
+        """Get the id, title, speaker name and status of the session with a join code"""
+        projection = {"_id": 0, "id": 1, "title": 1, "speakerName": 1, "status": 1}
+        info = await self.db.sessions.find_one({"joinCode": join_code}, projection)
+        if info is None:
+            info = await self.db.archived_sessions.find_one({"joinCode": join_code}, projection)
+        return info
     
+    @instrumented("db.get_active_join_codes")
+    async def get_active_join_codes(self) -> List[Dict[str, Any]]:
+        """Get join code, id, title, speaker name and status of every active session"""
+        cursor = self.db.sessions.find(
+            {"status": "active"},
+            {"_id": 0, "joinCode": 1, "id": 1, "title": 1, "speakerName": 1, "status": 1}
+        )
+        return [entry async for entry in cursor]
+    
+    @instrumented("db.get_user_sessions")
     async def get_user_sessions(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get all sessions for a user"""
-        cursor = self.db.sessions.find({
+        """Get all sessions for a user, archived ones included, with only the fields listings show"""
+        query = {
             "$or": [
                 {"speakerId": user_id},
                 {"participants": user_id}
             ]
-        }).sort("createdAt", -1)
+        }
         
         sessions = []
-        async for session in cursor:
-            session.pop('_id', None)
-            sessions.append(session)
+        for collection in (self.db.sessions, self.db.archived_sessions):
+            async for session in collection.find(query, SESSION_SUMMARY_PROJECTION):
+                sessions.append(session)
+        sessions.sort(key=lambda session: session["createdAt"], reverse=True)
         return sessions
     
+    async def _update_session(self, session_id: str, update: Dict[str, Any], query: Optional[Dict[str, Any]] = None):
+        """Apply a write to a session, cancelling any archive claim on it.
+        
+        The archiver only drops a session whose claim is intact, so a write landing
+        mid-archive makes it start over. A session archived between the caller
+        loading it and this write is restored first, so the write is never lost.
+        """
+        update = {**update, "$unset": {"archivingAt": ""}}
+        query = {"id": session_id, **(query or {})}
+        result = await self.db.sessions.update_one(query, update)
+        if result.matched_count == 0 and self.archive and await self.get_archive_pointer(session_id):
+            await self.archive.restore(session_id)
+            result = await self.db.sessions.update_one(query, update)
+        await self._invalidate_session(session_id)
+        return result
+    
+    @instrumented("db.add_session_participant")
     async def add_session_participant(self, session_id: str, user_id: str):
         """Add participant to session"""
-        await self.db.sessions.update_one(
-            {"id": session_id},
-            {"$addToSet": {"participants": user_id}}
-        )
+        await self._update_session(session_id, {"$addToSet": {"participants": user_id}})
     
+    @instrumented("db.is_session_participant")
     async def is_session_participant(self, session_id: str, user_id: str) -> bool:
         """Check if user is session participant"""
-        session = await self.db.sessions.find_one({
-            "id": session_id,
-            "participants": user_id
-        })
-        return session is not None
+        session = await self.get_session(session_id)
+        return session is not None and user_id in session.get("participants", [])
     
+    @instrumented("db.add_transcript_chunk")
     async def add_transcript_chunk(self, session_id: str, chunk: Dict[str, Any]):
         """Add transcript chunk to session"""
-        await self.db.sessions.update_one(
+        await self._update_session(session_id, {"$push": {"transcript": chunk}})
+    
+    @instrumented("db.get_transcript_window")
+    async def get_transcript_window(self, session_id: str, size: int) -> Optional[Dict[str, Any]]:
+        """Get the newest `size` transcript chunks of a session and how far it has been indexed"""
+        return await self.db.sessions.find_one(
             {"id": session_id},
-            {"$push": {"transcript": chunk}}
+            {"_id": 0, "transcript": {"$slice": -size}, "indexedThrough": 1, "indexedCount": 1}
         )
     
-    async def add_session_resource(self, session_id: str, resource: Dict[str, Any]):
-        """Add resource to session"""
-        await self.db.sessions.update_one(
+    @instrumented("db.get_transcript_page")
+    async def get_transcript_page(self, session_id: str, start: int, size: int) -> List[Dict[str, Any]]:
+        """Get up to `size` transcript chunks of a session, starting at position `start`"""
+        session = await self.db.sessions.find_one(
             {"id": session_id},
-            {"$push": {"resources": resource}}
+            {"_id": 0, "transcript": {"$slice": [start, size]}}
+        )
+        return session.get("transcript", []) if session else []
+    
+    @instrumented("db.advance_index_watermark")
+    async def advance_index_watermark(
+        self, session_id: str, previous: Optional[str], current: Optional[str], count: int
+    ) -> bool:
+        """Move indexedThrough from previous to current (the count-th chunk); False if another worker moved it first"""
+        result = await self.db.sessions.update_one(
+            {"id": session_id, "indexedThrough": previous},
+            {"$set": {"indexedThrough": current, "indexedCount": count}}
         )
+        await self._invalidate_session(session_id)
+        return result.matched_count == 1
+    
+    @instrumented("db.add_session_resource")
+    async def add_session_resource(self, session_id: str, resource: Dict[str, Any]):
+        """Add resource to session"""
+        await self._update_session(session_id, {"$push": {"resources": resource}})
     
+    @instrumented("db.set_active_resource")
     async def set_active_resource(self, session_id: str, resource_id: str):
         """Set active resource for session"""
         # First, set all resources to inactive
-        await self.db.sessions.update_one(
-            {"id": session_id},
-            {"$set": {"resources.$[].isActive": False}}
-        )
+        await self._update_session(session_id, {"$set": {"resources.$[].isActive": False}})
         
         # Then set the specified resource to active
-        await self.db.sessions.update_one(
-            {"id": session_id, "resources.id": resource_id},
-            {"$set": {"resources.$.isActive": True}}
+        await self._update_session(
+            session_id, {"$set": {"resources.$.isActive": True}}, {"resources.id": resource_id}
         )
     
+    @instrumented("db.get_active_resource")
     async def get_active_resource(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get active resource for session"""
-        session = await self.db.sessions.find_one({"id": session_id})
+        session = await self.get_session(session_id)
         if session and "resources" in session:
             for resource in session["resources"]:
                 if resource.get("isActive", False):
                     return resource
         return None
     
+    @instrumented("db.set_session_tasks")
     async def set_session_tasks(self, session_id: str, tasks: List[Dict[str, Any]]):
         """Set tasks for session"""
+        await self._update_session(session_id, {"$set": {"tasks": tasks}})
+    
+    @instrumented("db.end_session")
+    async def end_session(self, session_id: str, archive_after: str):
+        """Mark a session ended; it becomes eligible for archiving at archive_after"""
         await self.db.sessions.update_one(
             {"id": session_id},
-            {"$set": {"tasks": tasks}}
+            {"$set": {"status": "ended", "archiveAfter": archive_after}}
+        )
+        await self._invalidate_session(session_id)
+    
+    @instrumented("db.claim_session_for_archive")
+    async def claim_session_for_archive(self, stale_claim_before: str) -> Optional[Dict[str, Any]]:
+        """Atomically claim one ended session that is due for archiving and return it, with its archivingAt claim"""
+        # The claim keeps several workers from archiving the same session; a claim
+        # left behind by a crashed worker expires at stale_claim_before, and any
+        # write to the session cancels it (see _update_session)
+        now = datetime.utcnow().isoformat()
+        session = await self.db.sessions.find_one_and_update(
+            {
+                "status": "ended",
+                "$and": [
+                    {"$or": [{"archiveAfter": {"$exists": False}}, {"archiveAfter": {"$lt": now}}]},
+                    {"$or": [{"archivingAt": {"$exists": False}}, {"archivingAt": {"$lt": stale_claim_before}}]}
+                ]
+            },
+            {"$set": {"archivingAt": now}},
+            return_document=ReturnDocument.AFTER
         )
+        if session:
+            session.pop('_id', None)
+        return session
+    
+    @instrumented("db.replace_with_archive_pointer")
+    async def replace_with_archive_pointer(self, session: Dict[str, Any], archive_file: str, claimed_at: str) -> bool:
+        """Swap an archived session's hot document for a small pointer to its archive file.
+        
+        Returns False, leaving the session in place, if it was written to since it was
+        claimed at claimed_at, as the archive then misses that write.
+        """
+        pointer = {key: session.get(key) for key in SESSION_SUMMARY_PROJECTION if key != "_id"}
+        pointer.update({
+            "participants": session.get("participants", []),
+            "archiveFile": archive_file,
+            "archivedAt": datetime.utcnow().isoformat()
+        })
+        await self.db.archived_sessions.replace_one({"id": session["id"]}, pointer, upsert=True)
+        result = await self.db.sessions.delete_one({"id": session["id"], "archivingAt": claimed_at})
+        if result.deleted_count == 0:
+            await self.db.archived_sessions.delete_one({"id": session["id"], "archiveFile": archive_file})
+            return False
+        await self._invalidate_session(session["id"])
+        return True
+    
+    @instrumented("db.get_archive_pointer")
+    async def get_archive_pointer(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get the archive pointer of a session, if it is archived"""
+        return await self.db.archived_sessions.find_one({"id": session_id}, {"_id": 0})
+    
+    @instrumented("db.restore_session")
+    async def restore_session(self, session: Dict[str, Any]):
+        """Put an archived session back into the hot collection"""
+        await self.db.sessions.replace_one({"id": session["id"]}, session, upsert=True)
+        await self.db.archived_sessions.delete_one({"id": session["id"]})
+        await self._invalidate_session(session["id"])
     
     async def close(self):
         """Close database connection"""
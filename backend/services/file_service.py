@@ -1,11 +1,16 @@
 import os
 import uuid
+import logging
 import aiofiles
 from fastapi import UploadFile
 from typing import Tuple
 import shutil
 from pathlib import Path
 
+from services.metrics import instrumented
+
+logger = logging.getLogger(__name__)
+
 class FileService:
     def __init__(self):
         self.upload_dir = Path("uploads")
@@ -28,6 +33,7 @@ class FileService:
         else:
             return 'document'  # Default
     
+    @instrumented("file.save")
     async def save_file(self, file: UploadFile) -> Tuple[str, str]:
         """Save uploaded file and return URL and type"""
         file_type = self.get_file_type(file.filename)
@@ -64,7 +70,7 @@ class FileService:
             if file_path.exists():
                 file_path.unlink()
         except Exception as e:
-            print(f"Error deleting file {file_url}: {e}")
+            logger.error(f"Error deleting file {file_url}: {e}")
     
     def get_file_info(self, file_url: str) -> dict:
         """Get file information"""
@@ -80,6 +86,6 @@ class FileService:
                     "modified": stat.st_mtime
                 }
         except Exception as e:
-            print(f"Error getting file info {file_url}: {e}")
+            logger.error(f"Error getting file info {file_url}: {e}")
         
         return {}
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import re
+from typing import Any, Dict, Optional
+
+from services import metrics
+from services.admission import AdmissionRejected
+from services.shared_cache import SharedCache
+
+# Join codes are the first 8 hex characters of a uuid4, upper-cased
+JOIN_CODE_PATTERN = re.compile(r"^[0-9A-F]{8}$")
+
+def normalize_join_code(code: str) -> Optional[str]:
+    """Canonical form of a join code, or None when it can't be one"""
+    code = code.strip().upper()
+    return code if JOIN_CODE_PATTERN.match(code) else None
+
+class JoinCodeIndex:
+    """Join code lookups served from the shared cache, with unknown codes cached as misses"""
+
+    def __init__(self, db_service, cache: SharedCache):
+        self.db = db_service
+        self.cache = cache
+        self.ttl = float(os.getenv("JOIN_CODE_CACHE_TTL", "3600"))
+        self.negative_ttl = float(os.getenv("JOIN_CODE_NEGATIVE_TTL", "300"))
+        self.client_rate = float(os.getenv("JOIN_CODE_LOOKUPS_PER_MINUTE", "120")) / 60
+        self.client_burst = float(os.getenv("JOIN_CODE_LOOKUP_BURST", "60"))
+
+    async def check_rate(self, client_id: str):
+        """Charge the client's lookup bucket, shared by every worker, or raise AdmissionRejected"""
+        wait = await self.cache.take(f"rate:joincode:{client_id}", self.client_rate, self.client_burst)
+        if wait:
+            metrics.admission_rejections.inc(reason="join_code_rate")
+            raise AdmissionRejected("Too many join code lookups, please slow down", wait)
+
+    async def load(self):
+        """Index every active session so lookups of live codes never reach the database"""
+        for entry in await self.db.get_active_join_codes():
+            await self._store(entry.pop("joinCode"), entry)
+
+    @staticmethod
+    def _local_ttl(entry: Dict[str, Any]) -> float:
+        # Misses are stored as an empty entry and kept in each worker only briefly,
+        # so a code created afterwards shows up everywhere soon
+        return 60 if entry else 10
+
+    async def _store(self, join_code: str, entry: Dict[str, Any]):
+        ttl = self.ttl if entry else self.negative_ttl
+        await self.cache.set(f"joincode:{join_code}", entry, ttl, local_ttl=self._local_ttl(entry))
+
+    async def lookup(self, join_code: str, client_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Return id, title, speakerName and status of the session with this code, or None.
+
+        With client_id, lookups that don't hit a known code (malformed, unknown or not
+        yet cached) are charged to that client's bucket, so a whole room joining with
+        the right code is never limited while scanning for codes stays slow.
+        """
+        normalized = normalize_join_code(join_code)
+        if normalized is None:
+            metrics.cache_events.inc(cache="joincode", result="invalid")
+            if client_id:
+                await self.check_rate(client_id)
+            return None
+
+        entry = await self.cache.get(f"joincode:{normalized}", local_ttl=self._local_ttl)
+        if entry:
+            return entry
+        if client_id:
+            await self.check_rate(client_id)
+        if entry is not None:
+            return None
+
+        entry = await self.db.get_join_code_info(normalized)
+        await self._store(normalized, entry or {})
+        return entry
+
+    async def add(self, session: Dict[str, Any]):
+        """Index a new session, replacing any cached miss for its code"""
+        await self._store(session["joinCode"], {
+            "id": session["id"],
+            "title": session["title"],
+            "speakerName": session["speakerName"],
+            "status": session["status"]
+        })
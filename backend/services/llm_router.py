@@ -0,0 +1,330 @@
+import os
+import time
+import logging
+import random
+import asyncio
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+class ProviderUnavailableError(Exception):
+    """Raised when no LLM provider could produce a completion"""
+
+class LLMProvider:
+    """Base class for a chat completion backend"""
+
+    name = "provider"
+
+    def load(self):
+        """Import and configure the SDK ahead of the first request"""
+
+    async def complete(self, prompt: str, system: Optional[str], max_tokens: int, temperature: float) -> str:
+        raise NotImplementedError
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo"):
+        self.api_key = api_key
+        self.model = model
+        self._client = None
+
+    def load(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(api_key=self.api_key)
+
+    async def complete(self, prompt: str, system: Optional[str], max_tokens: int, temperature: float) -> str:
+        self.load()
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.append({"role": "user", "content": prompt})
+
+        response = await self._client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return response.choices[0].message.content.strip()
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model: str = "gemini-pro"):
+        self.api_key = api_key
+        self.model_name = model
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            # The Gemini SDK is slow to import, so only pay for it when Gemini is used
+            import google.generativeai as genai
+
+            genai.configure(api_key=self.api_key)
+            self.model = genai.GenerativeModel(self.model_name)
+
+    async def complete(self, prompt: str, system: Optional[str], max_tokens: int, temperature: float) -> str:
+        if self.model is None:
+            await asyncio.to_thread(self.load)
+        response = await asyncio.to_thread(self.model.generate_content, prompt)
+        return response.text.strip()
+
+class StubProvider(LLMProvider):
+    """Local stand-in provider with configurable latency and failure rate"""
+
+    def __init__(
+        self,
+        name: str = "stub",
+        response: str = "This is a stub response.",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        responder: Optional[Callable[[str], str]] = None
+    ):
+        self.name = name
+        self.response = response
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.responder = responder
+        self.calls = 0
+
+    async def complete(self, prompt: str, system: Optional[str], max_tokens: int, temperature: float) -> str:
+        self.calls += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"{self.name} stub failure")
+        return self.responder(prompt) if self.responder else self.response
+
+class ProviderStats:
+    """Rolling latency and error-rate window for one provider"""
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, success: bool, latency: Optional[float] = None):
+        self.outcomes.append(success)
+        if success and latency is not None:
+            self.latencies.append(latency)
+
+    def record_abandoned(self, latency: float):
+        """A call cancelled before answering took at least this long"""
+        self.latencies.append(latency)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+class CircuitBreaker:
+    """Stop sending traffic to a provider after repeated failures"""
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_in_flight:
+            # Let a single trial request through to probe recovery
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release(self):
+        """Give back a trial slot whose request was abandoned without a result"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+class LLMRouter:
+    """Route completions across providers with failover, hedging and circuit breaking"""
+
+    def __init__(
+        self,
+        providers: List[LLMProvider],
+        timeout: Optional[float] = None,
+        hedge_percentile: Optional[float] = None,
+        hedge_delay: Optional[float] = None,
+        breaker_failures: Optional[int] = None,
+        breaker_cooldown: Optional[float] = None
+    ):
+        self.providers = providers
+        self.timeout = timeout if timeout is not None else float(os.getenv("LLM_TIMEOUT", "20"))
+        # 0 disables hedging; otherwise hedge once the primary passes this latency percentile
+        self.hedge_percentile = hedge_percentile if hedge_percentile is not None else float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        # Hedge delay used until a provider has enough latency samples
+        self.hedge_delay = hedge_delay if hedge_delay is not None else float(os.getenv("LLM_HEDGE_DELAY", "3"))
+        failures = breaker_failures if breaker_failures is not None else int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+        cooldown = breaker_cooldown if breaker_cooldown is not None else float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+        self.stats = {provider.name: ProviderStats() for provider in providers}
+        self.breakers = {provider.name: CircuitBreaker(failures, cooldown) for provider in providers}
+
+    @classmethod
+    def from_env(cls) -> "LLMRouter":
+        """Build a router holding every provider that has an API key configured"""
+        keys = {
+            "openai": os.getenv("OPENAI_API_KEY"),
+            "gemini": os.getenv("GEMINI_API_KEY")
+        }
+        factories = {"openai": OpenAIProvider, "gemini": GeminiProvider}
+        order = os.getenv("LLM_PROVIDER_ORDER", "openai,gemini").split(",")
+
+        providers = []
+        for name in (entry.strip() for entry in order):
+            if name in factories and keys.get(name):
+                try:
+                    providers.append(factories[name](keys[name]))
+                except Exception as e:
+                    logger.error(f"Error initializing {name} provider: {e}")
+        return cls(providers)
+
+    async def warm_up(self):
+        """Load every provider SDK in parallel, off the event loop"""
+        await asyncio.gather(*[asyncio.to_thread(provider.load) for provider in self.providers])
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Current health of each provider"""
+        return {
+            name: {
+                "state": self.breakers[name].state,
+                "error_rate": stats.error_rate,
+                "p50": stats.percentile(50),
+                "p95": stats.percentile(95)
+            }
+            for name, stats in self.stats.items()
+        }
+
+    def _hedge_after(self, provider: LLMProvider) -> Optional[float]:
+        if not self.hedge_percentile:
+            return None
+        stats = self.stats[provider.name]
+        if len(stats.latencies) < 20:
+            return self.hedge_delay
+        return max(0.05, stats.percentile(self.hedge_percentile))
+
+    async def _call(self, provider: LLMProvider, prompt: str, system: Optional[str], max_tokens: int, temperature: float) -> str:
+        started = time.monotonic()
+        try:
+            with metrics.timed(f"llm.{provider.name}"):
+                result = await provider.complete(prompt, system, max_tokens, temperature)
+        except asyncio.CancelledError:
+            # Calls that lose a hedge are the slow ones; leaving them out would drag the
+            # hedge percentile down until hedging fired on nearly every call
+            self.stats[provider.name].record_abandoned(time.monotonic() - started)
+            self.breakers[provider.name].release()
+            raise
+        except Exception as e:
+            logger.warning(f"LLM provider {provider.name} failed: {e}")
+            metrics.provider_errors.inc(provider=provider.name)
+            self.stats[provider.name].record(False)
+            self.breakers[provider.name].record_failure()
+            raise
+        self.stats[provider.name].record(True, time.monotonic() - started)
+        self.breakers[provider.name].record_success()
+        return result
+
+    async def complete(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        max_tokens: int = 300,
+        temperature: float = 0.7
+    ) -> str:
+        """Return the first successful completion from the available providers"""
+        queue = list(self.providers)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        pending: Dict[asyncio.Task, LLMProvider] = {}
+        errors = []
+        hedge_at = None
+
+        def launch() -> bool:
+            nonlocal hedge_at
+            while queue:
+                provider = queue.pop(0)
+                # Asked lazily so a half-open breaker only spends its trial on a real call
+                if not self.breakers[provider.name].allow():
+                    errors.append(f"{provider.name}: circuit open")
+                    continue
+                task = asyncio.create_task(self._call(provider, prompt, system, max_tokens, temperature))
+                pending[task] = provider
+                delay = self._hedge_after(provider)
+                hedge_at = loop.time() + delay if delay is not None else None
+                return True
+            return False
+
+        if not launch():
+            raise ProviderUnavailableError("; ".join(errors) or "No LLM provider is configured")
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    break
+
+                can_hedge = queue and len(pending) == 1 and hedge_at is not None
+                wake_at = min(deadline, hedge_at) if can_hedge else deadline
+                done, _ = await asyncio.wait(
+                    pending, timeout=max(0, wake_at - now), return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    if can_hedge and loop.time() >= hedge_at:
+                        # The primary is slower than usual, race the next provider against it
+                        launch()
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(f"{provider.name}: {task.exception()}")
+
+                if not pending and queue:
+                    launch()
+
+            for provider in pending.values():
+                metrics.provider_errors.inc(provider=provider.name)
+                self.stats[provider.name].record(False)
+                self.breakers[provider.name].record_failure()
+                errors.append(f"{provider.name}: timed out")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise ProviderUnavailableError("; ".join(errors) or "No LLM provider responded")
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import fcntl
+import bisect
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage timings of the current request, read back for the Server-Timing header
+_request_timings: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_timings", default=None)
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def values(self) -> Dict[Tuple[str, ...], Any]:
+        """Copy of the current value of every label combination"""
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], Any]] = None) -> List[str]:
+        header = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return header + self._samples(self.values() if values is None else values)
+
+    def _samples(self, values: Dict[Tuple[str, ...], Any]) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in sorted(values.items())]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function = function
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from a callback at scrape time"""
+        self._function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def values(self) -> Dict[Tuple[str, ...], Any]:
+        if self._function:
+            return {(): self._function()}
+        return super().values()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket (non-cumulative) counts, then sum and count
+            series = self._values.setdefault(key, [0.0] * (len(self.buckets) + 3))
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self, values: Dict[Tuple[str, ...], List[float]]) -> List[str]:
+        lines = []
+        for key, series in sorted(values.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_label = 'le="' + le + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class Registry:
+    """Holds every metric and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        """Every metric's values in a JSON-friendly form"""
+        return {
+            name: [[list(key), value] for key, value in metric.values().items()]
+            for name, metric in self._metrics.items()
+        }
+
+    def render(self, merged: Optional[Dict[str, Dict[Tuple[str, ...], Any]]] = None) -> str:
+        """Render this process's metrics, or merged values from several processes"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(None if merged is None else merged.get(metric.name, {})))
+        return "\n".join(lines) + "\n"
+
+    def merge(self, merged: Dict[str, Dict[Tuple[str, ...], Any]], snapshot: Dict[str, List[list]], gauges: bool = True):
+        """Add a snapshot's values into merged; histograms add bucket by bucket"""
+        for name, series in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is None or (metric.kind == "gauge" and not gauges):
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in series:
+                key = tuple(key)
+                total = values.get(key)
+                if total is None:
+                    values[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    values[key] = [a + b for a, b in zip(total, value)]
+                else:
+                    values[key] = total + value
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "panda_http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+))
+http_requests_in_flight = registry.register(Gauge(
+    "panda_http_requests_in_flight", "HTTP requests currently being served"
+))
+stage_duration = registry.register(Histogram(
+    "panda_stage_duration_seconds", "Latency of individual request stages", ["stage"]
+))
+cache_events = registry.register(Counter(
+    "panda_cache_events_total", "Cache and request coalescing outcomes", ["cache", "result"]
+))
+provider_errors = registry.register(Counter(
+    "panda_provider_errors_total", "Errors returned by upstream providers", ["provider"]
+))
+fallbacks = registry.register(Counter(
+    "panda_fallbacks_total", "Responses served from a canned fallback", ["kind"]
+))
+admission_rejections = registry.register(Counter(
+    "panda_admission_rejections_total", "Requests rejected by admission control", ["reason"]
+))
+archive_events = registry.register(Counter(
+    "panda_archive_events_total", "Sessions moved to and from cold storage", ["action"]
+))
+llm_in_flight = registry.register(Gauge(
+    "panda_llm_requests_in_flight", "AI requests holding an admission slot"
+))
+llm_queued = registry.register(Gauge(
+    "panda_llm_requests_queued", "AI requests waiting for an admission slot"
+))
+
+# Under gunicorn each worker publishes its metrics to <METRICS_DIR>/<pid>.json, and
+# /metrics in any worker merges them. Counters and histograms of exited workers are
+# folded into exited.json so totals never go backwards; their gauges are dropped.
+EXITED_SNAPSHOT = "exited.json"
+
+def _read_snapshot(path: str) -> Optional[Dict[str, List[list]]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def write_snapshot(directory: str):
+    """Publish this process's metrics for other workers to merge"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+def render_all(directory: str) -> str:
+    """Render the metrics of every worker sharing directory, merged"""
+    write_snapshot(directory)
+    exited: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+    live = []
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        registry.merge(exited, _read_snapshot(os.path.join(directory, EXITED_SNAPSHOT)) or {}, gauges=False)
+        folded = False
+        for name in os.listdir(directory):
+            stem, extension = os.path.splitext(name)
+            if extension != ".json" or not stem.isdigit():
+                continue
+            snapshot = _read_snapshot(os.path.join(directory, name))
+            if snapshot is None:
+                continue
+            if _process_alive(int(stem)):
+                live.append(snapshot)
+            else:
+                registry.merge(exited, snapshot, gauges=False)
+                os.remove(os.path.join(directory, name))
+                folded = True
+        if folded:
+            path = os.path.join(directory, EXITED_SNAPSHOT)
+            with open(path + ".tmp", "w") as f:
+                json.dump({name: [[list(key), value] for key, value in values.items()] for name, values in exited.items()}, f)
+            os.replace(path + ".tmp", path)
+
+    merged = exited
+    for snapshot in live:
+        registry.merge(merged, snapshot)
+    return registry.render(merged)
+
+async def publish_periodically(directory: str, interval: float):
+    """Keep this worker's published snapshot fresh between scrapes"""
+    while True:
+        write_snapshot(directory)
+        await asyncio.sleep(interval)
+
+def start_request_timings() -> object:
+    """Begin collecting stage timings for the current request"""
+    return _request_timings.set({})
+
+def finish_request_timings(token: object) -> Dict[str, List[float]]:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+def current_request_timings() -> Dict[str, List[float]]:
+    return _request_timings.get() or {}
+
+def record_stage(stage: str, seconds: float):
+    stage_duration.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.setdefault(stage, []).append(seconds)
+
+@contextmanager
+def timed(stage: str):
+    """Time a block as a named stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def instrumented(stage: str):
+    """Decorator timing every call of an async function as a named stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with timed(stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing_header(timings: Dict[str, List[float]], total: float) -> str:
+    """Format collected stage timings as a Server-Timing header value"""
+    entries = []
+    for stage, samples in timings.items():
+        # Server-Timing metric names are tokens, so keep them simple
+        name = stage.replace(".", "-").replace(" ", "_")
+        entry = f"{name};dur={sum(samples) * 1000:.1f}"
+        if len(samples) > 1:
+            entry += f';desc="x{len(samples)}"'
+        entries.append(entry)
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,305 @@
+"""Two-tier cache shared by every worker process.
+
+Each worker keeps a small in-process LRU (L1) in front of a cache server that
+the process manager starts once and workers reach over a Unix domain socket
+(L2). Without a socket configured, L2 is just another in-process store, so a
+single development process behaves the same way.
+
+Run the server on its own with:
+    python -m services.shared_cache --socket /tmp/panda-cache.sock
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import subprocess
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Union
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class LocalCache:
+    """In-process LRU with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+def take_token(store: LocalCache, key: str, rate: float, capacity: float) -> float:
+    """Token bucket kept in a cache entry: consume a token and return 0, or the seconds until one is available"""
+    now = time.monotonic()
+    tokens, updated = store.get(key) or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    wait = 0.0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) / rate if rate else 60.0
+    # An untouched bucket refills completely, so it can expire once that has happened
+    store.set(key, (tokens, now), capacity / rate + 1 if rate else 3600)
+    return wait
+
+async def _read_frame(reader: asyncio.StreamReader) -> Any:
+    size = int.from_bytes(await reader.readexactly(4), "big")
+    return json.loads(await reader.readexactly(size))
+
+def _write_frame(writer: asyncio.StreamWriter, message: Any):
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    writer.write(len(body).to_bytes(4, "big") + body)
+
+class CacheServer:
+    """Cache process serving get/set/delete over a Unix domain socket"""
+
+    def __init__(self, socket_path: str, max_entries: int = 100000):
+        self.socket_path = socket_path
+        self.store = LocalCache(max_entries)
+
+    def _handle(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "get":
+            value = self.store.get(request["key"], _MISSING)
+            return {"hit": False} if value is _MISSING else {"hit": True, "value": value}
+        if op == "set":
+            self.store.set(request["key"], request["value"], request["ttl"])
+            return {"ok": True}
+        if op == "delete":
+            self.store.delete(request["key"])
+            return {"ok": True}
+        if op == "clear":
+            self.store.clear()
+            return {"ok": True}
+        if op == "take":
+            # Runs inside one event loop iteration, so concurrent takes from all workers never interleave
+            return {"wait": take_token(self.store, request["key"], request["rate"], request["capacity"])}
+        return {"error": f"unknown op {op!r}"}
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await _read_frame(reader)
+                _write_frame(writer, self._handle(request))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._serve_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"Shared cache listening on {self.socket_path}")
+        async with server:
+            await server.serve_forever()
+
+def run_server(socket_path: str, max_entries: int = 100000):
+    """Blocking entry point for the cache server process"""
+    asyncio.run(CacheServer(socket_path, max_entries).serve())
+
+def start_server_process(socket_path: str, max_entries: int = 100000, wait: float = 5.0) -> subprocess.Popen:
+    """Start the cache server in a child process and wait until it accepts connections"""
+    # A plain subprocess rather than multiprocessing, whose bookkeeping forked workers would inherit
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "services.shared_cache", "--socket", socket_path, "--max-entries", str(max_entries)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+
+    deadline = time.monotonic() + wait
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return process
+
+class SharedCache:
+    """Client for the shared cache tier with an in-process L1 in front"""
+
+    def __init__(self, socket_path: Optional[str] = None, pool_size: int = 4, timeout: float = 0.25,
+                 max_local_entries: int = 5000, failure_threshold: int = 3, retry_after: float = 5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        # A single slow reply doesn't take the server out; this many in a row does, for retry_after seconds
+        self.failure_threshold = failure_threshold
+        self.retry_after = retry_after
+        self._failures = 0
+        self.local = LocalCache(max_local_entries)
+        # Stands in for the server when no socket is configured or it is unreachable
+        self.fallback = LocalCache(max_local_entries * 4)
+        self._pool: asyncio.Queue = asyncio.Queue()
+        for _ in range(pool_size):
+            self._pool.put_nowait(None)
+        self._down_until = 0.0
+        # Keys written or deleted while the server was unreachable: the server may still hold
+        # their old values, so they are deleted there before anything else once it answers again
+        self._stale: "OrderedDict[str, None]" = OrderedDict()
+        self._max_stale = max_local_entries
+        self._clear_on_reconnect = False
+        self._replaying = False
+
+    @classmethod
+    def from_env(cls) -> "SharedCache":
+        return cls(
+            socket_path=os.getenv("SHARED_CACHE_SOCKET") or None,
+            max_local_entries=int(os.getenv("SHARED_CACHE_LOCAL_ENTRIES", "5000"))
+        )
+
+    async def _request(self, message: dict) -> Optional[dict]:
+        """Send one request to the server; None when it can't be reached"""
+        if not self.socket_path or time.monotonic() < self._down_until:
+            return None
+        if (self._stale or self._clear_on_reconnect) and not self._replaying:
+            if not await self._replay_stale():
+                return None
+        return await self._exchange(message)
+
+    def _mark_stale(self, key: str):
+        if not self.socket_path:
+            return
+        self._stale[key] = None
+        self._stale.move_to_end(key)
+        if len(self._stale) > self._max_stale:
+            # Too many to replay one by one; start the server over instead
+            self._stale.clear()
+            self._clear_on_reconnect = True
+
+    async def _replay_stale(self) -> bool:
+        """Drop keys from the server that changed while it was unreachable; False if it still is"""
+        self._replaying = True
+        try:
+            if self._clear_on_reconnect:
+                if await self._exchange({"op": "clear"}) is None:
+                    return False
+                self._clear_on_reconnect = False
+                self._stale.clear()
+            while self._stale:
+                key = next(iter(self._stale))
+                if await self._exchange({"op": "delete", "key": key}) is None:
+                    return False
+                self._stale.pop(key, None)
+            return True
+        finally:
+            self._replaying = False
+
+    async def _exchange(self, message: dict) -> Optional[dict]:
+        connection = await self._pool.get()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_unix_connection(self.socket_path), self.timeout)
+            reader, writer = connection
+            _write_frame(writer, message)
+            await writer.drain()
+            response = await asyncio.wait_for(_read_frame(reader), self.timeout)
+            self._failures = 0
+            return response
+        except asyncio.CancelledError:
+            # A half-finished exchange would desync the connection, so drop it
+            if connection is not None:
+                connection[1].close()
+            connection = None
+            raise
+        except Exception as e:
+            if connection is not None:
+                connection[1].close()
+            connection = None
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                logger.warning(f"Shared cache unavailable, using process-local cache: {e}")
+                self._down_until = time.monotonic() + self.retry_after
+                self._failures = 0
+            return None
+        finally:
+            self._pool.put_nowait(connection)
+
+    async def get(self, key: str, local_ttl: Union[float, Callable[[Any], float], None] = None) -> Any:
+        """Return the cached value or None; local_ttl also keeps a copy in the worker's L1.
+
+        local_ttl may be a function of the value, e.g. to keep cached misses only briefly.
+        """
+        namespace = key.split(":", 1)[0]
+        if local_ttl:
+            value = self.local.get(key, _MISSING)
+            if value is not _MISSING:
+                metrics.cache_events.inc(cache=namespace, result="hit")
+                return value
+
+        response = await self._request({"op": "get", "key": key})
+        if response is None:
+            value = self.fallback.get(key, _MISSING)
+        else:
+            value = response["value"] if response.get("hit") else _MISSING
+
+        if value is _MISSING:
+            metrics.cache_events.inc(cache=namespace, result="miss")
+            return None
+
+        metrics.cache_events.inc(cache=namespace, result="hit")
+        if callable(local_ttl):
+            local_ttl = local_ttl(value)
+        if local_ttl:
+            self.local.set(key, value, local_ttl)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float, local_ttl: Optional[float] = None):
+        if local_ttl:
+            self.local.set(key, value, min(ttl, local_ttl))
+        if await self._request({"op": "set", "key": key, "value": value, "ttl": ttl}) is None:
+            self.fallback.set(key, value, ttl)
+            self._mark_stale(key)
+
+    async def take(self, key: str, rate: float, capacity: float) -> float:
+        """Charge a token bucket shared by every worker; 0 on success, else seconds until a token frees up"""
+        response = await self._request({"op": "take", "key": key, "rate": rate, "capacity": capacity})
+        if response is None:
+            return take_token(self.fallback, key, rate, capacity)
+        return response["wait"]
+
+    async def delete(self, key: str):
+        self.local.delete(key)
+        self.fallback.delete(key)
+        if await self._request({"op": "delete", "key": key}) is None:
+            self._mark_stale(key)
+
+    async def close(self):
+        while not self._pool.empty():
+            connection = self._pool.get_nowait()
+            if connection is not None:
+                connection[1].close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PANDA shared cache server")
+    parser.add_argument("--socket", default=os.getenv("SHARED_CACHE_SOCKET", "/tmp/panda-cache.sock"))
+    parser.add_argument("--max-entries", type=int, default=int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "100000")))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_server(args.socket, args.max_entries)
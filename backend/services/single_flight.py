@@ -0,0 +1,38 @@
+import re
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from services import metrics
+
+def normalize_text(text: str) -> str:
+    """Case- and punctuation-insensitive form of a question, used as a coalescing key"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers with the same key"""
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter has gone away
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() unless a call for key is already running, and return its result"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            metrics.cache_events.inc(cache=self.name, result="miss")
+        else:
+            metrics.cache_events.inc(cache=self.name, result="coalesced")
+
+        # Shielded so one caller disconnecting doesn't cancel the others' result;
+        # a result or error of the shared call reaches every waiter
+        return await asyncio.shield(task)
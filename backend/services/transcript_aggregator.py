@@ -0,0 +1,132 @@
+import os
+import re
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+from services.context_builder import ContextBuilder
+
+_SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*\s*$")
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+class TranscriptAggregator:
+    """Merge consecutive speech-to-text fragments into overlapping passages for indexing.
+
+    Works from the stored transcript rather than per-process buffers, so whichever
+    worker receives a fragment builds the same passages. `indexed_through` is the id
+    of the last fragment already covered by an indexed passage.
+    """
+
+    def __init__(self, count_tokens: Optional[Callable[[str], int]] = None):
+        self.passage_tokens = int(os.getenv("TRANSCRIPT_PASSAGE_TOKENS", "200"))
+        self.min_passage_tokens = int(os.getenv("TRANSCRIPT_MIN_PASSAGE_TOKENS", "60"))
+        self.overlap_tokens = int(os.getenv("TRANSCRIPT_OVERLAP_TOKENS", "40"))
+        self.max_buffer_seconds = float(os.getenv("TRANSCRIPT_MAX_BUFFER_SECONDS", "30"))
+        # How many of the newest fragments are read back to build passages
+        self.window = int(os.getenv("TRANSCRIPT_INDEX_WINDOW", "200"))
+        self.count_tokens = count_tokens or ContextBuilder().count_tokens
+
+    def _split(self, transcript: List[Dict[str, Any]], indexed_through: Optional[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Split a transcript (or its newest window) into indexed and pending fragments"""
+        for position in range(len(transcript) - 1, -1, -1):
+            if transcript[position]["id"] == indexed_through:
+                return transcript[:position + 1], transcript[position + 1:]
+        return [], transcript
+
+    def covers(self, transcript: List[Dict[str, Any]], indexed_through: Optional[str]) -> bool:
+        """Whether a window of the newest fragments reaches back to indexed_through"""
+        if len(transcript) < self.window:
+            return True
+        return any(chunk["id"] == indexed_through for chunk in transcript)
+
+    def pending_chunks(self, transcript: List[Dict[str, Any]], indexed_through: Optional[str]) -> List[Dict[str, Any]]:
+        """Fragments stored but not yet part of an indexed passage"""
+        _, pending = self._split(transcript, indexed_through)
+        return [
+            {"id": chunk["id"], "text": chunk["text"].strip(), "timestamp": chunk["timestamp"]}
+            for chunk in pending
+        ]
+
+    def build(
+        self,
+        session_id: str,
+        transcript: List[Dict[str, Any]],
+        indexed_through: Optional[str],
+        final: bool = False
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return the passages that are ready to index and the new indexed_through.
+
+        With final, the remaining fragments become a passage too, e.g. when the session ends.
+        """
+        indexed, pending = self._split(transcript, indexed_through)
+        fragments = self._carry(self._fragments(indexed))
+        waiting = 0
+        passages = []
+        watermark = indexed_through
+
+        for fragment in self._fragments(pending):
+            fragments.append(fragment)
+            waiting += 1
+            if self._is_ready(fragments, fragments[-waiting]):
+                passages.append(self._passage(session_id, fragments))
+                watermark = fragment["id"]
+                fragments = self._carry(fragments[1:])
+                waiting = 0
+
+        if final and waiting:
+            passages.append(self._passage(session_id, fragments))
+            watermark = fragments[-1]["id"]
+        return passages, watermark
+
+    def _fragments(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "id": chunk["id"],
+                "text": chunk["text"].strip(),
+                "timestamp": chunk["timestamp"],
+                "speakerId": chunk.get("speakerId"),
+                "tokens": self.count_tokens(chunk["text"])
+            }
+            for chunk in chunks
+        ]
+
+    def _carry(self, fragments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The newest fragments that fit in the overlap, to open the next passage"""
+        carry = []
+        carried_tokens = 0
+        for fragment in reversed(fragments):
+            if carried_tokens + fragment["tokens"] > self.overlap_tokens:
+                break
+            carry.insert(0, fragment)
+            carried_tokens += fragment["tokens"]
+        return carry
+
+    def _is_ready(self, fragments: List[Dict[str, Any]], first_pending: Dict[str, Any]) -> bool:
+        tokens = sum(fragment["tokens"] for fragment in fragments)
+        if tokens >= self.passage_tokens:
+            return True
+        if tokens >= self.min_passage_tokens and _SENTENCE_END_RE.search(fragments[-1]["text"]):
+            return True
+        # Speech spread over a long stretch is indexed even if it is short
+        started = _parse_timestamp(first_pending["timestamp"])
+        latest = _parse_timestamp(fragments[-1]["timestamp"])
+        return bool(started and latest) and (latest - started).total_seconds() >= self.max_buffer_seconds
+
+    @staticmethod
+    def passage_id(session_id: str, chunk_id: str) -> str:
+        """Id of the passage ending with this fragment; the newest fragment is unique to its passage"""
+        return f"{session_id}_{chunk_id}"
+
+    def _passage(self, session_id: str, fragments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "id": self.passage_id(session_id, fragments[-1]["id"]),
+            "text": " ".join(fragment["text"] for fragment in fragments if fragment["text"]),
+            "chunk_ids": [fragment["id"] for fragment in fragments],
+            "start_timestamp": fragments[0]["timestamp"],
+            "end_timestamp": fragments[-1]["timestamp"],
+            "speakerId": fragments[-1]["speakerId"]
+        }
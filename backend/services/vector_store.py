@@ -1,127 +1,330 @@
 import os
-import pinecone
-from typing import List, Dict, Any
-import openai
-from datetime import datetime
+import asyncio
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+from services.transcript_aggregator import TranscriptAggregator
+from services.single_flight import SingleFlight
+from services import metrics
+from services.shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
 
 class VectorStoreService:
-    def __init__(self):
+    def __init__(self, cache: Optional[SharedCache] = None):
         self.pinecone_key = os.getenv("PINECONE_API_KEY")
         self.pinecone_env = os.getenv("PINECONE_ENVIRONMENT")
         self.openai_key = os.getenv("OPENAI_API_KEY")
         self.index_name = "panda-transcripts"
+        self.aggregator = TranscriptAggregator()
+        # Set to the DatabaseService, where passages are built from the stored transcript
+        self.db = None
+        self.embedding_flight = SingleFlight("embeddings")
+        self.cache = cache
+        self.embedding_cache_ttl = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+        self.configured = bool(self.pinecone_key and self.pinecone_env)
+        self.index = None
+        self._openai = None
+        self._connect_lock = asyncio.Lock()
         
-        if self.pinecone_key and self.pinecone_env:
-            pinecone.init(api_key=self.pinecone_key, environment=self.pinecone_env)
-            
-            # Create index if it doesn't exist
-            if self.index_name not in pinecone.list_indexes():
-                pinecone.create_index(
-                    name=self.index_name,
-                    dimension=1536,  # OpenAI embedding dimension
-                    metric="cosine"
-                )
-            
-            self.index = pinecone.Index(self.index_name)
-        else:
-            print("Pinecone not configured - using mock vector store")
-            self.index = None
+        if not self.configured:
+            logger.warning("Pinecone not configured - using mock vector store")
+    
+    @property
+    def ready(self) -> bool:
+        return self.index is not None or not self.configured
+    
+    def _connect_index(self):
+        """Open (and if needed create) the Pinecone index; blocking network calls"""
+        import pinecone
         
-        if self.openai_key:
-            openai.api_key = self.openai_key
+        pinecone.init(api_key=self.pinecone_key, environment=self.pinecone_env)
+        
+        # Create index if it doesn't exist
+        if self.index_name not in pinecone.list_indexes():
+            pinecone.create_index(
+                name=self.index_name,
+                dimension=1536,  # OpenAI embedding dimension
+                metric="cosine"
+            )
+        
+        return pinecone.Index(self.index_name)
+    
+    async def connect(self):
+        """Connect to Pinecone once, without blocking the event loop"""
+        if self.ready:
+            return
+        async with self._connect_lock:
+            if not self.ready:
+                self.index = await asyncio.to_thread(self._connect_index)
+    
+    def _openai_client(self):
+        if self._openai is None:
+            from openai import AsyncOpenAI
+            
+            self._openai = AsyncOpenAI(api_key=self.openai_key)
+        return self._openai
     
     async def get_embedding(self, text: str) -> List[float]:
+        """Generate embedding for text, reusing cached and in-flight results for the same text"""
+        if not self.cache:
+            return await self.embedding_flight.do(text, lambda: self._create_embedding(text))
+        
+        cache_key = "embedding:" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+        embedding = await self.cache.get(cache_key, local_ttl=300)
+        if embedding:
+            return embedding
+        
+        embedding = await self.embedding_flight.do(text, lambda: self._create_embedding(text))
+        if any(embedding):
+            # All-zero vectors are fallbacks and must not be cached
+            await self.cache.set(cache_key, embedding, self.embedding_cache_ttl, local_ttl=300)
+        return embedding
+    
+    async def _create_embedding(self, text: str) -> List[float]:
         """Generate embedding for text using OpenAI"""
         if not self.openai_key:
             # Mock embedding for development
             return [0.0] * 1536
         
         try:
-            response = openai.Embedding.create(
-                input=text,
-                model="text-embedding-ada-002"
-            )
-            return response['data'][0]['embedding']
+            with metrics.timed("embedding"):
+                response = await self._openai_client().embeddings.create(
+                    input=text,
+                    model="text-embedding-ada-002"
+                )
+            return response.data[0].embedding
         except Exception as e:
-            print(f"Error generating embedding: {e}")
+            logger.error(f"Error generating embedding: {e}")
+            metrics.provider_errors.inc(provider="openai_embedding")
+            metrics.fallbacks.inc(kind="embedding")
             return [0.0] * 1536
     
-    async def store_transcript_chunk(self, session_id: str, chunk: Dict[str, Any]):
-        """Store transcript chunk in vector database"""
-        if not self.index:
-            return
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several texts in a single OpenAI request"""
+        if not self.openai_key:
+            return [[0.0] * 1536 for _ in texts]
         
         try:
-            # Generate embedding
-            embedding = await self.get_embedding(chunk["text"])
-            
-            # Store in Pinecone
-            self.index.upsert([
-                {
-                    "id": f"{session_id}_{chunk['id']}",
-                    "values": embedding,
-                    "metadata": {
-                        "session_id": session_id,
-                        "chunk_id": chunk["id"],
-                        "text": chunk["text"],
-                        "timestamp": chunk["timestamp"],
-                        "speaker_id": chunk["speakerId"]
-                    }
-                }
-            ])
+            with metrics.timed("embedding.batch"):
+                response = await self._openai_client().embeddings.create(
+                    input=texts,
+                    model="text-embedding-ada-002"
+                )
+            data = sorted(response.data, key=lambda item: item.index)
+            return [item.embedding for item in data]
+        except Exception as e:
+            logger.error(f"Error generating embeddings: {e}")
+            metrics.provider_errors.inc(provider="openai_embedding")
+            metrics.fallbacks.inc(kind="embedding")
+            return [[0.0] * 1536 for _ in texts]
+    
+    async def index_transcript(self, session_id: str, final: bool = False) -> Optional[str]:
+        """Index the passages completed by newly stored transcript fragments.
+        
+        Any worker may call this after a write. Passages are stored before the
+        indexedThrough watermark moves, and their ids are stable, so a worker
+        racing another one or retrying after an error only rewrites the same
+        vectors. With final (session ending), the remaining fragments are indexed
+        as well. Returns the session's watermark afterwards, or None when nothing is indexed.
+        """
+        if not self.configured or self.db is None:
+            return None
+        
+        state = await self.db.get_transcript_window(session_id, self.aggregator.window)
+        if not state:
+            return None
+        indexed_through = state.get("indexedThrough")
+        indexed_count = state.get("indexedCount", 0)
+        transcript = state.get("transcript", [])
+        if self.aggregator.covers(transcript, indexed_through):
+            indexed_through, _ = await self._index_page(session_id, transcript, indexed_through, indexed_count, final)
+            return indexed_through
+        
+        # Indexing fell more than a window behind (e.g. the provider was down): catch up
+        # page by page from the watermark, with a few indexed fragments for the overlap
+        while True:
+            start = max(0, indexed_count - max(1, self.aggregator.overlap_tokens))
+            page = await self.db.get_transcript_page(session_id, start, self.aggregator.window)
+            last = len(page) < self.aggregator.window
+            indexed_through, count = await self._index_page(
+                session_id, page, indexed_through, indexed_count, final and last
+            )
+            if last or count == indexed_count:
+                return indexed_through
+            indexed_count = count
+    
+    async def _index_page(
+        self,
+        session_id: str,
+        transcript: List[Dict[str, Any]],
+        indexed_through: Optional[str],
+        indexed_count: int,
+        final: bool
+    ) -> Tuple[Optional[str], int]:
+        """Index the ready passages of a run of fragments; return the new watermark and count"""
+        passages, watermark = self.aggregator.build(session_id, transcript, indexed_through, final)
+        if not passages:
+            return indexed_through, indexed_count
+        
+        try:
+            await self.store_transcript_passages(session_id, passages)
         except Exception as e:
-            print(f"Error storing transcript chunk: {e}")
+            # The watermark stays put, so the next write retries these fragments
+            logger.error(f"Error storing transcript passages: {e}")
+            metrics.provider_errors.inc(provider="pinecone")
+            return indexed_through, indexed_count
+        
+        ids = [chunk["id"] for chunk in transcript]
+        previous = ids.index(indexed_through) if indexed_through in ids else -1
+        count = indexed_count + ids.index(watermark) - previous
+        if not await self.db.advance_index_watermark(session_id, indexed_through, watermark, count):
+            # Another worker indexed these fragments first
+            return indexed_through, indexed_count
+        return watermark, count
+    
+    async def store_transcript_passages(self, session_id: str, passages: List[Dict[str, Any]]):
+        """Store aggregated transcript passages in vector database"""
+        if not self.configured or not passages:
+            return
+        
+        await self.connect()
+        
+        # Generate embeddings
+        embeddings = await self.get_embeddings([passage["text"] for passage in passages])
+        
+        vectors = [
+            {
+                "id": passage["id"],
+                "values": embedding,
+                "metadata": {
+                    "session_id": session_id,
+                    "chunk_id": passage["chunk_ids"][-1],
+                    "chunk_ids": passage["chunk_ids"],
+                    "text": passage["text"],
+                    "timestamp": passage["start_timestamp"],
+                    "end_timestamp": passage["end_timestamp"],
+                    "speaker_id": passage["speakerId"]
+                }
+            }
+            for passage, embedding in zip(passages, embeddings)
+        ]
+        
+        # Store in Pinecone
+        with metrics.timed("vector.upsert"):
+            self.index.upsert(vectors)
     
     async def query_similar_content(self, session_id: str, query: str, top_k: int = 5) -> List[str]:
         """Query for similar content in session"""
-        if not self.index:
+        chunks = await self.query_similar_chunks(session_id, query, top_k)
+        return [chunk["text"] for chunk in chunks]
+    
+    async def query_similar_chunks(
+        self,
+        session_id: str,
+        query: str,
+        top_k: int = 8,
+        pending: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """Query for similar transcript chunks in session, with score and timestamp.
+        
+        pending holds fragments not yet in an indexed passage (see TranscriptAggregator.pending_chunks).
+        """
+        if not self.configured:
             # Mock response for development
             return [
-                "Welcome everyone to today's session. Today we'll be covering the fundamentals of artificial intelligence and machine learning.",
-                "Let's start with the basics of neural networks and how they process information.",
-                "Machine learning models require careful validation and testing to ensure accuracy."
+                {"text": "Welcome everyone to today's session. Today we'll be covering the fundamentals of artificial intelligence and machine learning.", "timestamp": "2025-01-01T00:00:00", "score": 0.9},
+                {"text": "Let's start with the basics of neural networks and how they process information.", "timestamp": "2025-01-01T00:01:00", "score": 0.85},
+                {"text": "Machine learning models require careful validation and testing to ensure accuracy.", "timestamp": "2025-01-01T00:02:00", "score": 0.8}
             ]
         
         try:
+            await self.connect()
+            
             # Generate query embedding
             query_embedding = await self.get_embedding(query)
             
             # Query Pinecone
-            results = self.index.query(
-                vector=query_embedding,
-                filter={"session_id": session_id},
-                top_k=top_k,
-                include_metadata=True
-            )
+            with metrics.timed("vector.query"):
+                results = self.index.query(
+                    vector=query_embedding,
+                    filter={"session_id": session_id},
+                    top_k=top_k,
+                    include_metadata=True
+                )
             
-            # Extract text from results
+            # Extract chunks from results
             context_chunks = []
             for match in results["matches"]:
                 if match["score"] > 0.7:  # Similarity threshold
-                    context_chunks.append(match["metadata"]["text"])
+                    metadata = match["metadata"]
+                    context_chunks.append({
+                        "text": metadata["text"],
+                        "timestamp": metadata.get("timestamp"),
+                        "chunk_ids": metadata.get("chunk_ids", [metadata.get("chunk_id")]),
+                        "score": match["score"]
+                    })
+            
+            # Fragments still waiting for a passage are the freshest speech
+            for chunk in pending or []:
+                context_chunks.append({
+                    "text": chunk["text"],
+                    "timestamp": chunk["timestamp"],
+                    "chunk_ids": [chunk["id"]],
+                    "score": 0.7
+                })
             
             return context_chunks
         except Exception as e:
-            print(f"Error querying similar content: {e}")
+            logger.error(f"Error querying similar content: {e}")
+            metrics.provider_errors.inc(provider="pinecone")
+            return []
+    
+    def _passage_ids(self, session_id: str, transcript: List[Dict[str, Any]]) -> List[str]:
+        # Every passage is named after one of the session's fragments, so these cover them all
+        return [self.aggregator.passage_id(session_id, chunk["id"]) for chunk in transcript]
+    
+    async def export_session_vectors(self, session_id: str, transcript: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fetch every vector of a session with its values and metadata, for archiving"""
+        if not self.configured:
             return []
+        
+        # Errors propagate, so a session is never archived without its vectors
+        await self.connect()
+        ids = self._passage_ids(session_id, transcript)
+        vectors = []
+        with metrics.timed("vector.export"):
+            for start in range(0, len(ids), 100):
+                results = self.index.fetch(ids=ids[start:start + 100])
+                vectors.extend(
+                    {"id": vector_id, "values": list(vector["values"]), "metadata": dict(vector["metadata"])}
+                    for vector_id, vector in results["vectors"].items()
+                )
+        return vectors
     
-    async def delete_session_data(self, session_id: str):
+    async def restore_session_vectors(self, vectors: List[Dict[str, Any]]):
+        """Upsert vectors exported by export_session_vectors back into the index"""
+        if not self.configured or not vectors:
+            return
+        
+        # Errors propagate, so a session is never restored without its vectors
+        await self.connect()
+        with metrics.timed("vector.upsert"):
+            for start in range(0, len(vectors), 100):
+                self.index.upsert(vectors[start:start + 100])
+    
+    async def delete_session_data(self, session_id: str, transcript: List[Dict[str, Any]]):
         """Delete all data for a session"""
-        if not self.index:
+        if not self.configured:
             return
         
         try:
-            # Get all vectors for the session
-            results = self.index.query(
-                vector=[0.0] * 1536,  # Dummy vector
-                filter={"session_id": session_id},
-                top_k=10000,  # Get all
-                include_values=False
-            )
+            await self.connect()
             
-            # Delete vectors
-            ids_to_delete = [match["id"] for match in results["matches"]]
-            if ids_to_delete:
-                self.index.delete(ids=ids_to_delete)
+            # Deleting ids that were never stored is a no-op
+            ids = self._passage_ids(session_id, transcript)
+            for start in range(0, len(ids), 1000):
+                self.index.delete(ids=ids[start:start + 1000])
         except Exception as e:
-            print(f"Error deleting session data: {e}")
\ No newline at end of file
+            logger.error(f"Error deleting session data: {e}")
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected
+from services.shared_cache import SharedCache
+
+def make_controller(max_in_flight=1, max_queue=100, max_wait=5.0):
+    controller = AdmissionController(SharedCache())
+    controller.max_in_flight = max_in_flight
+    controller.max_queue = max_queue
+    controller.max_wait = max_wait
+    return controller
+
+async def serve_in_order(controller, requests):
+    """Queue requests behind a held slot, then record the order they are admitted in"""
+    order = []
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.slot("holder"):
+            await release.wait()
+
+    async def request(name, session_id, is_speaker):
+        async with controller.slot(session_id, is_speaker=is_speaker):
+            order.append(name)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    tasks = []
+    for name, session_id, is_speaker in requests:
+        tasks.append(asyncio.create_task(request(name, session_id, is_speaker)))
+        await asyncio.sleep(0)
+    assert controller.queued == len(requests)
+
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+def test_sessions_are_served_round_robin():
+    controller = make_controller()
+    requests = [("a1", "a", False), ("a2", "a", False), ("a3", "a", False), ("b1", "b", False), ("c1", "c", False), ("b2", "b", False)]
+
+    order = asyncio.run(serve_in_order(controller, requests))
+    # A busy session doesn't starve the others
+    assert order == ["a1", "b1", "c1", "a2", "b2", "a3"]
+    assert controller.in_flight == 0 and controller.queued == 0
+
+def test_speakers_jump_the_queue():
+    controller = make_controller()
+    requests = [("a1", "a", False), ("b1", "b", False), ("speaker", "b", True)]
+
+    order = asyncio.run(serve_in_order(controller, requests))
+    assert order == ["speaker", "a1", "b1"]
+
+def test_full_queue_rejects_listeners_but_not_speakers():
+    async def run():
+        controller = make_controller(max_queue=1)
+        release = asyncio.Event()
+
+        async def hold(session_id, is_speaker=False):
+            async with controller.slot(session_id, is_speaker=is_speaker):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold("a")), asyncio.create_task(hold("b"))]
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.slot("c"):
+                pass
+        # One slot, one queued request and a 1s service time estimate: about two services away
+        assert rejected.value.retry_after == 2
+
+        tasks.append(asyncio.create_task(hold("c", is_speaker=True)))
+        await asyncio.sleep(0)
+        assert controller.queued == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+def test_queue_timeout_rejects_and_frees_its_place():
+    async def run():
+        controller = make_controller(max_wait=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.slot("a"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            async with controller.slot("b"):
+                pass
+        assert controller.queued == 0
+
+        release.set()
+        await holder
+        assert controller.in_flight == 0
+
+    asyncio.run(run())
+
+def test_rate_limit_retry_after_is_time_to_next_token():
+    async def run():
+        controller = make_controller()
+        controller.user_rate = 12 / 60
+        controller.user_burst = 1
+
+        await controller.check_rate("session", "user")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.check_rate("session", "user")
+        return rejected.value
+
+    # One token every 5 seconds
+    assert asyncio.run(run()).retry_after == 5
+
+def test_rejection_becomes_429_with_retry_after():
+    from main import admission_rejected_handler
+
+    response = asyncio.run(admission_rejected_handler(None, AdmissionRejected("busy", 2.1)))
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
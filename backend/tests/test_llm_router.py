@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+
+from services.llm_router import LLMRouter, ProviderUnavailableError, StubProvider
+
+def make_router(*providers, **options):
+    options.setdefault("timeout", 2.0)
+    options.setdefault("hedge_percentile", 0)
+    return LLMRouter(list(providers), **options)
+
+def test_fails_over_to_next_provider():
+    broken = StubProvider("broken", failure_rate=1.0)
+    backup = StubProvider("backup", response="from backup")
+    router = make_router(broken, backup)
+
+    assert asyncio.run(router.complete("question")) == "from backup"
+    assert broken.calls == 1 and backup.calls == 1
+    assert router.stats["broken"].error_rate == 1.0
+    assert router.breakers["broken"].failures == 1
+
+def test_raises_when_every_provider_fails():
+    router = make_router(StubProvider("a", failure_rate=1.0), StubProvider("b", failure_rate=1.0))
+
+    with pytest.raises(ProviderUnavailableError) as error:
+        asyncio.run(router.complete("question"))
+    assert "a: a stub failure" in str(error.value) and "b: b stub failure" in str(error.value)
+
+def test_hedges_slow_primary_and_records_its_latency():
+    slow = StubProvider("slow", response="from slow", latency=1.0)
+    fast = StubProvider("fast", response="from fast")
+    router = make_router(slow, fast, hedge_percentile=95, hedge_delay=0.05)
+
+    async def run():
+        started = time.monotonic()
+        answer = await router.complete("question")
+        elapsed = time.monotonic() - started
+        # Let the losing call see its cancellation
+        await asyncio.sleep(0)
+        return answer, elapsed
+
+    answer, elapsed = asyncio.run(run())
+    assert answer == "from fast"
+    assert elapsed < 0.5
+    assert fast.calls == 1
+    # The abandoned primary still counts as a slow sample, not as a failure
+    assert list(router.stats["slow"].latencies) and router.stats["slow"].latencies[0] >= 0.05
+    assert not router.stats["slow"].outcomes
+    assert router.breakers["slow"].state == "closed"
+
+def test_no_hedge_when_primary_is_fast():
+    primary = StubProvider("primary", response="from primary", latency=0.01)
+    backup = StubProvider("backup")
+    router = make_router(primary, backup, hedge_percentile=95, hedge_delay=0.5)
+
+    assert asyncio.run(router.complete("question")) == "from primary"
+    assert backup.calls == 0
+
+def test_breaker_opens_then_half_opens_after_cooldown():
+    provider = StubProvider("flaky", failure_rate=1.0)
+    router = make_router(provider, breaker_failures=2, breaker_cooldown=0.1)
+
+    for _ in range(2):
+        with pytest.raises(ProviderUnavailableError):
+            asyncio.run(router.complete("question"))
+    assert router.breakers["flaky"].state == "open"
+
+    # While open the provider is skipped without being called
+    with pytest.raises(ProviderUnavailableError, match="circuit open"):
+        asyncio.run(router.complete("question"))
+    assert provider.calls == 2
+
+    # After the cooldown a single trial goes through; a failure opens it again
+    time.sleep(0.1)
+    with pytest.raises(ProviderUnavailableError):
+        asyncio.run(router.complete("question"))
+    assert provider.calls == 3
+    assert router.breakers["flaky"].state == "open"
+
+    # A successful trial closes it
+    time.sleep(0.1)
+    provider.failure_rate = 0.0
+    assert asyncio.run(router.complete("question")) == provider.response
+    assert router.breakers["flaky"].state == "closed"
+
+def test_half_open_allows_one_trial_at_a_time():
+    provider = StubProvider("flaky", failure_rate=1.0)
+    router = make_router(provider, breaker_failures=1, breaker_cooldown=0.0)
+
+    with pytest.raises(ProviderUnavailableError):
+        asyncio.run(router.complete("question"))
+    breaker = router.breakers["flaky"]
+    assert breaker.allow() is True
+    assert breaker.state == "half_open"
+    assert breaker.allow() is False
+
+def test_times_out_and_counts_a_failure():
+    provider = StubProvider("stuck", latency=1.0)
+    router = make_router(provider, timeout=0.05)
+
+    started = time.monotonic()
+    with pytest.raises(ProviderUnavailableError, match="stuck: timed out"):
+        asyncio.run(router.complete("question"))
+    assert time.monotonic() - started < 0.5
+    assert router.stats["stuck"].error_rate == 1.0
+    assert router.breakers["stuck"].failures == 1
+
+def test_snapshot_reports_provider_health():
+    router = make_router(StubProvider("stub"))
+    asyncio.run(router.complete("question"))
+
+    snapshot = router.snapshot()
+    assert snapshot["stub"]["state"] == "closed"
+    assert snapshot["stub"]["error_rate"] == 0.0
+    assert snapshot["stub"]["p50"] is not None
@@ -0,0 +1,50 @@
+import asyncio
+import os
+
+from services.shared_cache import CacheServer, SharedCache
+
+async def start_server(socket_path):
+    server = CacheServer(socket_path)
+    task = asyncio.create_task(server.serve())
+    while not os.path.exists(socket_path):
+        await asyncio.sleep(0.01)
+    return server, task
+
+def test_single_failure_does_not_mark_server_down(tmp_path):
+    async def run():
+        socket_path = str(tmp_path / "cache.sock")
+        server, task = await start_server(socket_path)
+        cache = SharedCache(socket_path, failure_threshold=3)
+
+        os.rename(socket_path, socket_path + ".moved")
+        assert await cache.get("session:1") is None
+        os.rename(socket_path + ".moved", socket_path)
+
+        await cache.set("session:1", {"title": "Lecture"}, 30)
+        assert server.store.get("session:1") == {"title": "Lecture"}
+        task.cancel()
+
+    asyncio.run(run())
+
+def test_writes_missed_while_down_are_replayed_as_deletes(tmp_path):
+    async def run():
+        socket_path = str(tmp_path / "cache.sock")
+        server, task = await start_server(socket_path)
+        cache = SharedCache(socket_path, failure_threshold=1, retry_after=0.05)
+        await cache.set("session:1", {"title": "Before"}, 30)
+
+        # While the server is unreachable the session changes and is invalidated locally only
+        os.rename(socket_path, socket_path + ".moved")
+        await cache.delete("session:1")
+        await cache.set("session:2", {"title": "Fallback"}, 30)
+        assert server.store.get("session:1") == {"title": "Before"}
+
+        os.rename(socket_path + ".moved", socket_path)
+        await asyncio.sleep(0.06)
+        # The first request after recovery drops the stale entries before anything is read
+        assert await cache.get("session:1") is None
+        assert server.store.get("session:1") is None
+        assert server.store.get("session:2") is None
+        task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight, normalize_text
+
+def test_concurrent_identical_calls_run_once():
+    async def run():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def answer():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*[flight.do("question", answer) for _ in range(5)])
+        return results, calls
+
+    results, calls = asyncio.run(run())
+    assert results == ["answer"] * 5
+    assert calls == 1
+
+def test_calls_after_completion_run_again():
+    async def run():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def answer():
+            calls.append(1)
+            return len(calls)
+
+        return await flight.do("question", answer), await flight.do("question", answer)
+
+    assert asyncio.run(run()) == (1, 2)
+
+def test_error_reaches_every_waiter():
+    async def run():
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("provider down")
+
+        return await asyncio.gather(*[flight.do("question", fail) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) and str(result) == "provider down" for result in results)
+
+def test_cancelled_call_reaches_every_waiter():
+    async def run():
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        waiters = [asyncio.create_task(flight.do("question", slow)) for _ in range(3)]
+        await started.wait()
+        flight._calls["question"].cancel()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+
+def test_one_waiter_leaving_does_not_cancel_the_others():
+    async def run():
+        flight = SingleFlight("test")
+
+        async def answer():
+            await asyncio.sleep(0.02)
+            return "answer"
+
+        leaving = asyncio.create_task(flight.do("question", answer))
+        staying = asyncio.create_task(flight.do("question", answer))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return await staying
+
+    assert asyncio.run(run()) == "answer"
+
+def test_normalize_text_ignores_case_and_punctuation():
+    assert normalize_text("What is  a Neural-Network?") == normalize_text("what is a neural network")